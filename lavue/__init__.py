@@ -19,4 +19,7 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor,
 # Boston, MA  02110-1301, USA.
 
-from .hidraLiveViewer import HidraLiveViewer
+# nothing is imported here: the viewers need PyQt4, the headless parts
+# (see headless) must run without it. Import the viewers from their
+# modules, lavue.hidraLiveViewer.HidraLiveViewer and
+# lavue.multiViewer.MultiDetectorViewer
@@ -0,0 +1,81 @@
+# Copyright (C) 2017  Christoph Rosemann, DESY, Notkestr. 85, D-22607 Hamburg
+# email contact: christoph.rosemann@desy.de
+#
+# lavue is an image viewing program for photon science imaging detectors.
+# Its usual application is as a live viewer using hidra as data source.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation in  version 2
+# of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+
+# preallocated numpy arrays for the decoding of frames
+
+import threading
+import numpy as np
+
+
+class BufferPool():
+    '''Reuses numpy arrays instead of allocating new ones for every frame.
+
+       Output buffers are keyed by shape and dtype. They are handed out by
+       getBuffer and come back with releaseBuffer once the image is not
+       displayed any more; getBuffer and releaseBuffer may be called from
+       different threads.
+       Scratch buffers belong to the calling thread, there is one per name
+       and thread, it only grows and a view of the requested size is
+       returned.'''
+
+    def __init__(self, depth=4):
+        # number of free buffers kept per shape and dtype
+        self._depth = depth
+        self._free = {}
+        self._scratch = threading.local()
+        self._lock = threading.Lock()
+
+    def getBuffer(self, shape, dtype):
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            free = self._free.get(key)
+            if free:
+                return free.pop()
+        return np.empty(shape, dtype=dtype)
+
+    def releaseBuffer(self, array):
+        '''Give back an array from getBuffer or any view on it.'''
+        if not isinstance(array, np.ndarray):
+            return
+        while isinstance(array.base, np.ndarray):
+            array = array.base
+        if not array.flags.owndata:
+            return
+        key = (array.shape, array.dtype.str)
+        with self._lock:
+            free = self._free.setdefault(key, [])
+            if len(free) < self._depth and \
+                    not any(buf is array for buf in free):
+                free.append(array)
+
+    def getScratch(self, name, size, dtype):
+        scratch = self._scratch.__dict__
+        buf = scratch.get(name)
+        if buf is None or buf.size < size or buf.dtype != np.dtype(dtype):
+            # some headroom, the compressed size changes from frame to frame
+            buf = np.empty(size + size // 8, dtype=dtype)
+            scratch[name] = buf
+        return buf[:size]
+
+    def clear(self):
+        with self._lock:
+            self._free = {}
+        self._scratch = threading.local()
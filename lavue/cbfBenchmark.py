@@ -0,0 +1,84 @@
+# Copyright (C) 2017  Christoph Rosemann, DESY, Notkestr. 85, D-22607 Hamburg
+# email contact: christoph.rosemann@desy.de
+#
+# lavue is an image viewing program for photon science imaging detectors.
+# Its usual application is as a live viewer using hidra as data source.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation in  version 2
+# of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+
+# simple benchmark of the cbf byte offset codec on synthetic frames
+# usage: python -m lavue.cbfBenchmark [--check]
+
+from __future__ import print_function
+
+import sys
+import time
+import numpy as np
+
+from . import bufferPool
+from . import cbfCodec
+from . import frameDecoders
+
+# detector geometries: (slow dimension, fast dimension)
+DETECTORS = [("300k", (619, 487)),
+             ("1M", (1043, 981)),
+             ("6M", (2527, 2463))]
+
+
+def timeDecoder(decoder, stream, repeat=5):
+    '''Best time of several decoding runs in seconds.'''
+    best = None
+    for dummy in range(repeat):
+        start = time.time()
+        decoder(stream)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(check=False):
+    backends = [name for name in cbfCodec.availableBackends()
+                if check or name != "loop"]
+    for name, shape in DETECTORS:
+        frame = cbfCodec.syntheticFrame(shape)
+        stream = cbfCodec.compressByteOffset(frame)
+        line = "%5s: %9d bytes, frames/s:" % (name, stream.size)
+        # reused output and scratch buffers, like in the data source
+        pool = bufferPool.BufferPool()
+        out = pool.getBuffer((frame.size,), np.int32)
+        for backend in backends:
+            cbfCodec.selectBackend(backend)
+            elapsed = timeDecoder(
+                lambda data: cbfCodec.decompress(data, out, pool), stream,
+                1 if backend == "loop" else 5)
+            line += " %s %.1f," % (backend, 1. / elapsed)
+        elapsed = timeDecoder(cbfCodec.compressByteOffset, frame)
+        line += " encoding %.1f" % (1. / elapsed)
+        if check:
+            legacy = cbfCodec.decompressByteOffsetLoop(stream)
+            for backend in backends:
+                cbfCodec.selectBackend(backend)
+                line += ", %s identical: %s" % (backend, np.array_equal(
+                    cbfCodec.decompress(stream), legacy))
+            image = frameDecoders.defaultRegistry().decode(
+                cbfCodec.encodeCbf(frame))
+            line += ", round trip: %s" % np.array_equal(image, frame)
+        print(line)
+
+
+if __name__ == "__main__":
+    main(check="--check" in sys.argv[1:])
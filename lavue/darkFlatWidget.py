@@ -0,0 +1,123 @@
+# Copyright (C) 2017  Christoph Rosemann, DESY, Notkestr. 85, D-22607 Hamburg
+# email contact: christoph.rosemann@desy.de
+#
+# lavue is an image viewing program for photon science imaging detectors.
+# Its usual application is as a live viewer using hidra as data source.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation in  version 2
+# of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+
+
+# averaged dark image and flat-field gain map
+
+from PyQt4 import QtCore, QtGui
+
+
+class DarkFlatWidget(QtGui.QWidget):
+
+    """
+    Take, load and save a dark image, load a flat-field gain map.
+    """
+
+    takeDark = QtCore.pyqtSignal(int)
+    darkFileSelection = QtCore.pyqtSignal(str)
+    darkFileSave = QtCore.pyqtSignal(str)
+    flatFileSelection = QtCore.pyqtSignal(str)
+
+    def __init__(self, parent=None, frames=10):
+        super(DarkFlatWidget, self).__init__(parent)
+
+        # one checkbox to choose whether the correction is applied
+        self.applyCorrectionBox = QtGui.QCheckBox(u"Dark/flat correction")
+        self.applyCorrectionBox.setChecked(False)
+        self.applyCorrectionBox.setEnabled(False)
+
+        self.framesBox = QtGui.QSpinBox()
+        self.framesBox.setRange(1, 1000)
+        self.framesBox.setValue(frames)
+        self.framesBox.setSuffix(" frames")
+        self.takeButton = QtGui.QPushButton("Take dark")
+        self.takeButton.clicked.connect(
+            lambda: self.takeDark.emit(self.framesBox.value()))
+
+        self.loadDarkButton = QtGui.QPushButton("Load dark")
+        self.loadDarkButton.clicked.connect(self.showDarkDialog)
+        self.saveDarkButton = QtGui.QPushButton("Save dark")
+        self.saveDarkButton.setEnabled(False)
+        self.saveDarkButton.clicked.connect(self.showSaveDialog)
+        self.loadFlatButton = QtGui.QPushButton("Load flat")
+        self.loadFlatButton.clicked.connect(self.showFlatDialog)
+
+        self.darkLabel = QtGui.QLabel("No dark")
+        self.flatLabel = QtGui.QLabel("No flat")
+
+        layout = QtGui.QGridLayout()
+        layout.addWidget(self.applyCorrectionBox, 0, 0, 1, 2)
+        layout.addWidget(self.framesBox, 1, 0)
+        layout.addWidget(self.takeButton, 1, 1)
+        layout.addWidget(self.loadDarkButton, 2, 0)
+        layout.addWidget(self.saveDarkButton, 2, 1)
+        layout.addWidget(self.darkLabel, 3, 0, 1, 2)
+        layout.addWidget(self.loadFlatButton, 4, 0)
+        layout.addWidget(self.flatLabel, 4, 1)
+
+        self.setLayout(layout)
+
+    def showDarkDialog(self):
+        fname = str(QtGui.QFileDialog.getOpenFileName(
+            self, 'Open dark image', '.'))
+        if fname:
+            self.darkFileSelection.emit(fname)
+
+    def showSaveDialog(self):
+        fname = str(QtGui.QFileDialog.getSaveFileName(
+            self, 'Save dark image', '.', 'Numpy files (*.npy)'))
+        if fname:
+            self.darkFileSave.emit(fname)
+
+    def showFlatDialog(self):
+        fname = str(QtGui.QFileDialog.getOpenFileName(
+            self, 'Open flat-field gain map', '.'))
+        if fname:
+            self.flatFileSelection.emit(fname)
+
+    def setDarkName(self, name):
+        if name == "":
+            self.darkLabel.setText("No dark")
+        else:
+            self.darkLabel.setText("Dark: ..." + str(name)[-24:])
+        self.saveDarkButton.setEnabled(name != "")
+        self._checkApplicable()
+
+    def setFlatName(self, name):
+        if name == "":
+            self.flatLabel.setText("No flat")
+        else:
+            self.flatLabel.setText("..." + str(name)[-24:])
+        self._checkApplicable()
+
+    def _checkApplicable(self):
+        self.applyCorrectionBox.setEnabled(
+            self.darkLabel.text() != "No dark" or
+            self.flatLabel.text() != "No flat")
+
+
+if __name__ == "__main__":
+    import sys
+
+    app = QtGui.QApplication(sys.argv)
+    myapp = DarkFlatWidget()
+    myapp.show()
+    sys.exit(app.exec_())
@@ -0,0 +1,150 @@
+# Copyright (C) 2017  Christoph Rosemann, DESY, Notkestr. 85, D-22607 Hamburg
+# email contact: christoph.rosemann@desy.de
+#
+# lavue is an image viewing program for photon science imaging detectors.
+# Its usual application is as a live viewer using hidra as data source.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation in  version 2
+# of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+
+# the interface of the data sources and the factory creating them
+
+from __future__ import print_function
+
+import importlib
+
+from . import bufferPool
+from . import frameDecoders
+from . import frameStore
+
+# name -> (module, class) of the known data sources, imported on demand
+SOURCES = {"hidra": ("hidra_cbf_source", "HiDRA_cbf_source"),
+           "directory": ("directorySource", "DirectorySource"),
+           "replay": ("replaySource", "ReplaySource"),
+           "shared": ("sharedFrames", "SharedMemorySource")}
+
+
+class DataSource(object):
+    '''Base class of the data sources.
+
+       A source is connected and disconnected and delivers frames with
+       getData as (image, name), (None, None) if there is none within its
+       timeout. getData is receive followed by decode, so that receiving
+       can stay in one thread while the payloads are decoded in others.
+       The payload format is recognized by the frameDecoders registry,
+       images are decoded into arrays of a BufferPool and should be given
+       back with releaseData.'''
+
+    def __init__(self, timeout=None, keepFrames=0):
+        # longest wait for a frame in ms, None: no limit
+        self._timeout = timeout
+        self._connected = False
+        # decoded frames are written into reused arrays
+        self.bufferPool = bufferPool.BufferPool()
+        # picks the decoder from the magic bytes of the payload
+        self.decoders = frameDecoders.defaultRegistry(self.bufferPool)
+        # the last compressed cbf frames, for re-decoding regions of them
+        self.frameStore = None
+        if keepFrames:
+            self.frameStore = frameStore.CbfFrameStore(keepFrames)
+
+    def getTarget(self):
+        '''Where the frames come from, for display.'''
+        raise NotImplementedError
+
+    def connect(self):
+        '''Start delivering frames, returns True on success.'''
+        self._connected = True
+        return True
+
+    def disconnect(self):
+        self._connected = False
+
+    def close(self):
+        '''Disconnect and free everything held for reconnecting.'''
+        self.disconnect()
+
+    def status(self):
+        '''Short description of the state of the source.'''
+        return "connected" if self._connected else "disconnected"
+
+    def getData(self):
+        data, metadata = self.receive()
+        if data is not None:
+            img = self.decode(data, metadata)
+            if img is not None:
+                return img, metadata["filename"]
+        return None, None
+
+    def receive(self):
+        '''Wait for the next payload, returns it and its metadata (a dict
+           with at least the "filename") without decoding, or None, None.'''
+        raise NotImplementedError
+
+    def stream(self):
+        '''Key of the current stream of frames, see DecoderRegistry.'''
+        return self.getTarget()
+
+    def decode(self, data, metadata):
+        '''Decode a payload from receive, may run in several threads.'''
+        frame = self.decodeOriented(data, metadata)
+        return None if frame is None else frame[0]
+
+    def decodeOriented(self, data, metadata):
+        '''Like decode, returns the image and the orientation it was
+           decoded in (see setOutput), or None.'''
+        # the geometry of a stream is only parsed again if it changes
+        img, decoder, header, orientation = self.decoders.decodeFrame(
+            data, metadata, self.stream())
+        if img is None:
+            print("[%s]::unknown data format" % type(self).__name__,
+                  repr(frameDecoders.headBytes(data)))
+            return None
+        if self.frameStore is not None and metadata is not None and \
+                decoder.name == "cbf-byte-offset":
+            # the header of the decode plan, not parsed again
+            self.frameStore.add(metadata["filename"], data, img,
+                                orientation, header)
+        return img, orientation
+
+    def setOutput(self, orientation=None, dtype=None):
+        '''Decode into the given orientation and dtype, see frameDecoders.'''
+        self.decoders.setOutput(orientation, dtype)
+
+    def releaseData(self, img):
+        '''Hand back an image from getData once it is not used any more.'''
+        self.bufferPool.releaseBuffer(img)
+
+    def discard(self, data, metadata):
+        '''Hand back a payload from receive that is not decoded.'''
+        pass
+
+    def region(self, name, top=0, bottom=None, left=0, right=None):
+        '''Re-decode rows top:bottom, columns left:right of a kept frame
+           in (slow, fast) layout, None if the frame is not kept.'''
+        if self.frameStore is None:
+            return None
+        return self.frameStore.region(name, top, bottom, left, right)
+
+
+def createSource(name, **options):
+    '''New data source of the given kind (a key of SOURCES), the options
+       are passed to its constructor.'''
+    if name not in SOURCES:
+        raise ValueError("Unknown data source %s, choose from %s"
+                         % (name, ", ".join(sorted(SOURCES))))
+    module, cls = SOURCES[name]
+    module = importlib.import_module("." + module, __package__)
+    return getattr(module, cls)(**options)
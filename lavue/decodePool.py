@@ -0,0 +1,222 @@
+# Copyright (C) 2017  Christoph Rosemann, DESY, Notkestr. 85, D-22607 Hamburg
+# email contact: christoph.rosemann@desy.de
+#
+# lavue is an image viewing program for photon science imaging detectors.
+# Its usual application is as a live viewer using hidra as data source.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation in  version 2
+# of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+
+# decoding of received frames in worker threads
+
+from __future__ import print_function
+
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+class WorkerGroup(object):
+    '''Threads decoding the frames of one or more DecodePools, e.g. of
+       several detectors sharing the cores of one viewer.
+       Every frame queued by a pool is announced with the pool, a worker
+       takes the oldest announcement and decodes the next frame of that
+       pool; the pools are served in the order their frames arrive.'''
+
+    def __init__(self, workers=2):
+        self.workers = max(1, int(workers))
+        self._pools = queue.Queue()
+        self._threads = []
+
+    def start(self):
+        if self._threads:
+            return
+        for dummy in range(self.workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        '''Wait for the workers to finish the frames being decoded.'''
+        for dummy in self._threads:
+            self._pools.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def announce(self, pool):
+        self._pools.put(pool)
+
+    def _work(self):
+        while True:
+            pool = self._pools.get()
+            if pool is None:
+                break
+            try:
+                pool._decodeNext()
+            except Exception as error:
+                # a failing deliver must not cost the worker
+                print("[decode pool] delivering failed: %s" % error)
+
+
+class DecodePool(object):
+    '''Decodes frames in worker threads.
+
+       numpy releases the GIL for the bulk of the decoding, so several
+       frames are decoded at the same time while the caller keeps on
+       receiving. Every submitted frame gets a sequence number, results
+       are passed to deliver(seq, name, image, submitted) according to the
+       policy, submitted is the time of the submit call:
+       "ordered" delivers all frames in sequence, "latest" delivers a frame
+       only if it is newer than the last one delivered and drops stale
+       frames. Decoded images which are dropped are passed to release,
+       the decode arguments of frames dropped or failing before they are
+       decoded to discard(*args), e.g. to free what the payload holds.
+       The worker threads are the pool's own unless a shared WorkerGroup
+       is given as group, which is then started and stopped by its owner.'''
+
+    POLICIES = ("latest", "ordered")
+
+    def __init__(self, decode, deliver, workers=2, policy="latest",
+                 release=None, group=None, discard=None):
+        if policy not in self.POLICIES:
+            raise ValueError("Unknown delivery policy: %s" % policy)
+        self._decode = decode
+        self._deliver = deliver
+        self._release = release
+        self._discard = discard
+        self.policy = policy
+        self._ownGroup = group is None
+        self.group = WorkerGroup(workers) if group is None else group
+        self.workers = self.group.workers
+        # a few frames waiting per worker, more would only add latency
+        self._tasks = queue.Queue(2 * self.workers)
+        self._lock = threading.Lock()
+        self._ready = {}
+        self._submitted = 0
+        self._delivered = -1
+        # frames decoded, failed or dropped, see drain
+        self._done = 0
+        # frames replaced or decoded too late, and frames failing to decode
+        self.dropped = 0
+        self.failed = 0
+
+    def start(self):
+        if self._ownGroup:
+            self.group.start()
+
+    def stop(self):
+        '''Skip the waiting frames and wait for the own workers.'''
+        self._clear()
+        if self._ownGroup:
+            self.group.stop()
+
+    def submit(self, name, *args):
+        '''Queue decode(*args), returns the sequence number of the frame.'''
+        seq = self._submitted
+        self._submitted += 1
+        task = (seq, name, args, time.time())
+        if self.policy == "ordered":
+            self._tasks.put(task)
+            self.group.announce(self)
+            return seq
+        while True:
+            try:
+                self._tasks.put_nowait(task)
+                self.group.announce(self)
+                return seq
+            except queue.Full:
+                # replace the oldest waiting frame, it was announced
+                # already
+                if self._clear(1):
+                    with self._lock:
+                        self.dropped += 1
+                        self._done += 1
+                    self._tasks.put_nowait(task)
+                    return seq
+
+    def drain(self, timeout=None):
+        '''Wait until every submitted frame is delivered or dropped,
+           returns False if the timeout in seconds passed before.'''
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with self._lock:
+                if self._done >= self._submitted:
+                    return True
+            if deadline is not None and time.time() > deadline:
+                return False
+            time.sleep(.005)
+
+    def _clear(self, count=None):
+        # announcements of cleared frames find nothing to decode
+        cleared = 0
+        while count is None or cleared < count:
+            try:
+                task = self._tasks.get_nowait()
+            except queue.Empty:
+                break
+            cleared += 1
+            self._discardTask(task)
+            if self.policy == "ordered":
+                self._finish(task[0], task[1], None, task[3])
+        return cleared
+
+    def _decodeNext(self):
+        try:
+            task = self._tasks.get_nowait()
+        except queue.Empty:
+            return
+        seq, name, args, submitted = task
+        try:
+            image = self._decode(*args)
+        except Exception as error:
+            print("[decode pool] decoding %s failed: %s" % (name, error))
+            image = None
+        if image is None:
+            with self._lock:
+                self.failed += 1
+            self._discardTask(task)
+        self._finish(seq, name, image, submitted)
+
+    def _discardTask(self, task):
+        if self._discard is None:
+            return
+        try:
+            self._discard(*task[2])
+        except Exception as error:
+            print("[decode pool] discarding %s failed: %s" % (task[1], error))
+
+    def _finish(self, seq, name, image, submitted):
+        with self._lock:
+            self._done += 1
+            if self.policy == "ordered":
+                self._ready[seq] = (name, image, submitted)
+                while self._delivered + 1 in self._ready:
+                    self._delivered += 1
+                    name, image, submitted = self._ready.pop(self._delivered)
+                    if image is not None:
+                        self._deliver(self._delivered, name, image, submitted)
+            elif seq > self._delivered and image is not None:
+                self._delivered = seq
+                self._deliver(seq, name, image, submitted)
+            elif image is not None:
+                self.dropped += 1
+                if self._release is not None:
+                    self._release(image)
@@ -0,0 +1,187 @@
+# Copyright (C) 2017  Christoph Rosemann, DESY, Notkestr. 85, D-22607 Hamburg
+# email contact: christoph.rosemann@desy.de
+#
+# lavue is an image viewing program for photon science imaging detectors.
+# Its usual application is as a live viewer using hidra as data source.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation in  version 2
+# of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+
+# frames from the files a detector writes into a local directory
+
+import collections
+import os
+import time
+
+from . import dataSource
+
+try:
+    # inotify events instead of polling, linux only
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+try:
+    scandir = os.scandir
+except AttributeError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+POLLINTERVAL = .005  # seconds between two scans of the directory
+
+
+class DirectorySource(dataSource.DataSource):
+    '''Delivers the files written into a directory (e.g. /ramdisk/) after
+       the connect, in the order they are completed; files present before
+       are ignored. Only files with a suffix of the known frame formats
+       are read.
+
+       With inotify_simple installed, a file is taken as complete once it
+       is closed after writing or moved into the directory. Otherwise the
+       directory is scanned and a file is complete once its size and
+       modification time did not change between two scans.
+       If latest is set, older waiting files are skipped.'''
+
+    def __init__(self, path=".", timeout=None, keepFrames=0, latest=False,
+                 poll=POLLINTERVAL, useInotify=True):
+        super(DirectorySource, self).__init__(timeout, keepFrames)
+        self.path = path
+        self.latest = latest
+        self.poll = poll
+        self.useInotify = useInotify and inotify_simple is not None
+        self.suffixes = tuple(sfx.lower() for sfx in self.decoders.suffixes())
+        self.skipped = 0
+        self._inotify = None
+        # completed files waiting to be read
+        self._ready = collections.deque()
+        # name -> (size, mtime) of the files seen by the last scan
+        self._seen = {}
+        self._growing = {}
+
+    def getTarget(self):
+        return self.path
+
+    def connect(self):
+        if not os.path.isdir(self.path):
+            return False
+        self.disconnect()
+        if self.useInotify:
+            flags = inotify_simple.flags
+            self._inotify = inotify_simple.INotify()
+            self._inotify.add_watch(
+                self.path, flags.CLOSE_WRITE | flags.MOVED_TO)
+        else:
+            self._seen = self._scan()
+        self._connected = True
+        return True
+
+    def disconnect(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+        self._ready.clear()
+        self._seen = {}
+        self._growing = {}
+        self._connected = False
+
+    def status(self):
+        if not self._connected:
+            return "disconnected"
+        return "watching %s (%s)" % (
+            self.path, "inotify" if self._inotify is not None else "polling")
+
+    def receive(self):
+        '''Wait up to the timeout for the next completed file.'''
+        if not self._connected:
+            return None, None
+        deadline = None
+        if self._timeout is not None:
+            deadline = time.time() + self._timeout / 1000.
+        while not self._ready:
+            left = None
+            if deadline is not None:
+                left = deadline - time.time()
+                if left < 0:
+                    return None, None
+            if self._inotify is not None:
+                # blocks until a file is completed
+                self._ready.extend(
+                    event.name for event in self._inotify.read(
+                        timeout=None if left is None else int(1000 * left))
+                    if self._wanted(event.name))
+            else:
+                self._ready.extend(self._completed())
+                if not self._ready:
+                    time.sleep(self.poll if left is None
+                               else min(self.poll, left))
+        if self.latest:
+            self.skipped += len(self._ready) - 1
+            name = self._ready.pop()
+            self._ready.clear()
+        else:
+            name = self._ready.popleft()
+        path = os.path.join(self.path, name)
+        try:
+            with open(path, "rb") as payload:
+                data = payload.read()
+        except (IOError, OSError):
+            # removed again in the meantime
+            return None, None
+        return data, {"filename": name, "path": path}
+
+    def _wanted(self, name):
+        return name.lower().endswith(self.suffixes)
+
+    def _scan(self):
+        '''name -> (size, mtime) of the frame files in the directory.'''
+        files = {}
+        if scandir is not None:
+            for entry in scandir(self.path):
+                if self._wanted(entry.name):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    files[entry.name] = (stat.st_size, stat.st_mtime)
+        else:
+            for name in os.listdir(self.path):
+                if self._wanted(name):
+                    try:
+                        stat = os.stat(os.path.join(self.path, name))
+                    except OSError:
+                        continue
+                    files[name] = (stat.st_size, stat.st_mtime)
+        return files
+
+    def _completed(self):
+        '''New files which did not change since the last scan, oldest
+           first.'''
+        files = self._scan()
+        done = []
+        growing = {}
+        for name, state in files.items():
+            if name in self._seen:
+                continue
+            if self._growing.get(name) == state and state[0] > 0:
+                done.append((state[1], name))
+            else:
+                growing[name] = state
+        self._growing = growing
+        # deleted files are forgotten, delivered ones are not read again
+        self._seen = dict((name, state) for name, state in files.items()
+                          if name in self._seen or name not in growing)
+        return [name for dummy, name in sorted(done)]
@@ -0,0 +1,55 @@
+# Copyright (C) 2017  Christoph Rosemann, DESY, Notkestr. 85, D-22607 Hamburg
+# email contact: christoph.rosemann@desy.de
+#
+# lavue is an image viewing program for photon science imaging detectors.
+# Its usual application is as a live viewer using hidra as data source.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation in  version 2
+# of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+
+# limits the redraws of the viewer independent of the frame rate
+
+import time
+
+
+class DisplayScheduler(object):
+    '''Decides when the next frame may be drawn, at most rate times per
+       second (0: unlimited). Frames arriving in between are coalesced,
+       the newest one is drawn when the interval has passed.
+
+       request is called when new frames are there and returns the
+       seconds to wait before drawing, 0 to draw now; markDrawn is called
+       after every draw.'''
+
+    def __init__(self, rate=25., clock=time.time):
+        self._clock = clock
+        self.setRate(rate)
+        self._last = None
+        self.requested = 0
+        self.drawn = 0
+
+    def setRate(self, rate):
+        self.rate = max(0., float(rate))
+        self.interval = 1. / self.rate if self.rate else 0.
+
+    def request(self):
+        self.requested += 1
+        if self._last is None:
+            return 0.
+        return max(0., self._last + self.interval - self._clock())
+
+    def markDrawn(self):
+        self._last = self._clock()
+        self.drawn += 1
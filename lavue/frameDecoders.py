@@ -0,0 +1,468 @@
+# Copyright (C) 2017  Christoph Rosemann, DESY, Notkestr. 85, D-22607 Hamburg
+# email contact: christoph.rosemann@desy.de
+#
+# lavue is an image viewing program for photon science imaging detectors.
+# Its usual application is as a live viewer using hidra as data source.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation in  version 2
+# of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+
+# decoders for the frame formats a data source can deliver,
+# the registry picks one from the magic bytes and the header
+
+import ast
+import threading
+import time
+import numpy as np
+
+from . import cbfCodec
+
+# element types of the cbf binary section
+CBF_ELEMENT_TYPES = {"signed 8-bit integer": "i1",
+                     "unsigned 8-bit integer": "u1",
+                     "signed 16-bit integer": "<i2",
+                     "unsigned 16-bit integer": "<u2",
+                     "signed 32-bit integer": "<i4",
+                     "unsigned 32-bit integer": "<u4"}
+
+# tiff field types of the tags needed
+TIFF_FIELD_TYPES = {1: "u1", 3: "u2", 4: "u4", 8: "i2", 9: "i4"}
+
+# tiff (bits per sample, sample format) -> dtype without byte order
+TIFF_TYPES = {(8, 1): "u1", (16, 1): "u2", (32, 1): "u4",
+              (8, 2): "i1", (16, 2): "i2", (32, 2): "i4",
+              (32, 3): "f4", (64, 3): "f8"}
+
+# dtypes accepted by the raw decoder
+RAW_TYPES = {"uint16": "<u2", "<u2": "<u2", "uint32": "<u4", "<u4": "<u4"}
+
+# output orientations: views of the (slow, fast) image and their inverse
+ORIENTATIONS = {"none": (lambda image: image, lambda image: image),
+                "transpose": (np.transpose, np.transpose),
+                "flipud": (np.flipud, np.flipud),
+                "fliplr": (np.fliplr, np.fliplr),
+                "rot90": (np.rot90, lambda image: np.rot90(image, -1))}
+
+# output dtypes the decoders can convert to
+OUTPUT_DTYPES = ("int32", "float32")
+
+
+def headBytes(data, size=16):
+    '''The first bytes of any buffer as a byte string.'''
+    return np.frombuffer(
+        data, dtype=np.uint8, count=min(size, len(data))).tobytes()
+
+
+def orientView(image, orientation, inverse=False):
+    '''View of the image in the given orientation (None: unchanged).'''
+    if orientation is None:
+        return image
+    return ORIENTATIONS[orientation][1 if inverse else 0](image)
+
+
+class FrameDecoder(object):
+    '''Base class of the frame decoders.
+
+       probe checks whether the decoder can handle the data and returns
+       the information decode needs (None otherwise). check does the same
+       for the next frame of a stream given the probe result and size of
+       the previous one; it only needs to be cheap where probe is not.
+       run decodes and keeps count of the frames, bytes and time spent,
+       which cost reports. Images are returned as (slow, fast) arrays,
+       i.e. rows first, unless setOutput asks for another orientation or
+       dtype; then they are written into contiguous (pooled) buffers.
+       output is the (orientation, dtype) pair of setOutput; run takes
+       it once per frame, so a frame decoded while setOutput is called
+       is consistently in one of the two.'''
+
+    # short name used in reports
+    name = None
+    # leading bytes of the payload, empty if only the header decides
+    magic = ()
+    # file name extensions
+    suffixes = ()
+    # decode applies orientation and dtype itself
+    orients = False
+
+    def __init__(self, pool=None):
+        self.pool = pool
+        self.orientation = None
+        self.dtype = None
+        self.output = (None, None)
+        # run may be called from several decoding threads
+        self._lock = threading.Lock()
+        self.resetCost()
+
+    def setOutput(self, orientation=None, dtype=None):
+        '''Orientation (key of ORIENTATIONS) and dtype of the images,
+           None keeps the decoded ones.'''
+        if orientation is not None and orientation not in ORIENTATIONS:
+            raise ValueError("Unknown orientation: %s" % orientation)
+        if dtype is not None and np.dtype(dtype).name not in OUTPUT_DTYPES:
+            raise ValueError("Unsupported output dtype: %s" % dtype)
+        self.orientation = None if orientation == "none" else orientation
+        self.dtype = None if dtype is None else np.dtype(dtype)
+        self.output = (self.orientation, self.dtype)
+
+    def orient(self, image, output=None):
+        '''The image in the output orientation and dtype, copied once
+           into a contiguous buffer unless it already fits.'''
+        orientation, dtype = output or self.output
+        view = orientView(image, orientation)
+        dtype = dtype or view.dtype
+        if orientation is None and view.dtype == dtype:
+            return view
+        if view.flags.c_contiguous and view.dtype == dtype:
+            return view
+        if self.pool is not None:
+            out = self.pool.getBuffer(view.shape, dtype)
+        else:
+            out = np.empty(view.shape, dtype=dtype)
+        out[...] = view
+        return out
+
+    def probe(self, data, metadata):
+        return None
+
+    def check(self, data, metadata, header, size):
+        return self.probe(data, metadata)
+
+    def decode(self, data, header):
+        raise NotImplementedError
+
+    def run(self, data, header, output=None):
+        start = time.time()
+        output = output or self.output
+        if self.orients:
+            image = self.decode(data, header, output)
+        else:
+            image = self.decode(data, header)
+            if image is not None:
+                image = self.orient(image, output)
+        elapsed = time.time() - start
+        with self._lock:
+            self.seconds += elapsed
+            self.frames += 1
+            self.bytes += len(data)
+        return image
+
+    def cost(self):
+        '''Mean decoding time in seconds per frame and per MB.'''
+        if not self.frames:
+            return None, None
+        return (self.seconds / self.frames,
+                self.seconds / max(self.bytes, 1) * 1e6)
+
+    def resetCost(self):
+        self.frames = 0
+        self.bytes = 0
+        self.seconds = 0.
+
+
+class CbfByteOffsetDecoder(FrameDecoder):
+    '''Byte offset compressed cbf, as written by Pilatus detectors.'''
+
+    name = "cbf-byte-offset"
+    magic = (b"###CBF",)
+    suffixes = (".cbf",)
+    orients = True
+
+    def probe(self, data, metadata):
+        header = cbfCodec.parseCbfHeader(data)
+        if header is not None and header.compression == cbfCodec.BYTE_OFFSET:
+            return header
+
+    def check(self, data, metadata, header, size):
+        return cbfCodec.checkCbfHeader(data, header, size)
+
+    def decode(self, data, header, output=None):
+        vals = [header.numElements, header.fastDim, header.slowDim,
+                header.padding]
+        if None in vals:
+            return None
+        # view on the binary section, no copy of the payload
+        stream = np.frombuffer(
+            data, dtype=np.uint8, offset=header.binaryStart,
+            count=header.binaryStop - header.binaryStart)
+        image = self.decompress(stream, np.array(vals, dtype='int'), output)
+        if image.ndim == 2:
+            return image
+        return None
+
+    def decompress(self, stream, vals, output=None):
+        '''Decode the binary section, vals holds the number of elements,
+           the fast and slow dimension and the padding.
+           Returns a (slow, fast) array in the output orientation.'''
+        if vals.size != 4 or min(vals) < 0 or vals[0] == 0 or \
+                vals[0] != vals[1] * vals[2]:
+            return np.array([0])
+        n_out, xdim, ydim, padding = vals
+
+        # the running sum goes straight into the image buffer unless
+        # the image is reordered or converted afterwards
+        output = output or self.output
+        direct = output[0] is None and output[1] in (None, np.dtype('int32'))
+        out = None
+        if self.pool is not None:
+            if direct:
+                out = self.pool.getBuffer((n_out + padding,), 'int32')
+            else:
+                out = self.pool.getScratch("sums", n_out + padding, 'int32')
+        res = cbfCodec.decompress(stream, out=out, pool=self.pool)
+
+        if ((res.size - padding) != n_out):
+            if self.pool is not None and direct:
+                self.pool.releaseBuffer(out)
+            return np.array([0])
+        # the fast dimension runs along the rows
+        image = res[0:n_out].reshape(ydim, xdim)
+        if direct:
+            return image
+        return self.orient(image, output)
+
+
+class CbfNoneDecoder(FrameDecoder):
+    '''Uncompressed cbf.'''
+
+    name = "cbf-none"
+    magic = (b"###CBF",)
+    suffixes = (".cbf",)
+
+    def probe(self, data, metadata):
+        header = cbfCodec.parseCbfHeader(data)
+        if header is None or header.compression != "x-CBF_NONE" or \
+                header.elementType not in CBF_ELEMENT_TYPES or \
+                None in (header.fastDim, header.slowDim):
+            return None
+        return header
+
+    def check(self, data, metadata, header, size):
+        return cbfCodec.checkCbfHeader(data, header, size)
+
+    def decode(self, data, header):
+        dtype = np.dtype(CBF_ELEMENT_TYPES[header.elementType])
+        count = header.fastDim * header.slowDim
+        if header.binaryStart + count * dtype.itemsize > len(data):
+            return None
+        return np.frombuffer(
+            data, dtype=dtype, count=count, offset=header.binaryStart
+        ).reshape(header.slowDim, header.fastDim)
+
+
+class RawDecoder(FrameDecoder):
+    '''Raw little endian uint16 or uint32 pixels. The geometry comes in a
+       side header, i.e. the metadata contains "shape" (rows, columns)
+       and "dtype" ("uint16" or "uint32").'''
+
+    name = "raw"
+    suffixes = (".raw",)
+
+    def probe(self, data, metadata):
+        try:
+            shape = tuple(int(dim) for dim in metadata["shape"])
+            dtype = np.dtype(RAW_TYPES[str(metadata["dtype"])])
+        except (KeyError, TypeError, ValueError):
+            return None
+        if len(shape) != 2 or \
+                shape[0] * shape[1] * dtype.itemsize != len(data):
+            return None
+        return shape, dtype
+
+    def decode(self, data, header):
+        shape, dtype = header
+        return np.frombuffer(data, dtype=dtype).reshape(shape)
+
+
+class TiffDecoder(FrameDecoder):
+    '''Uncompressed single channel tiff.'''
+
+    name = "tiff"
+    magic = (b"II*\x00", b"MM\x00*")
+    suffixes = (".tif", ".tiff")
+
+    def probe(self, data, metadata):
+        head = np.frombuffer(data, dtype=np.uint8)
+        order = "<" if headBytes(data, 2) == b"II" else ">"
+        try:
+            offset = int(head[4:8].view(order + "u4")[0])
+            count = int(head[offset:offset + 2].view(order + "u2")[0])
+            tags = {}
+            for pos in range(offset + 2, offset + 2 + 12 * count, 12):
+                tag, ftype, number = (
+                    int(head[pos:pos + 2].view(order + "u2")[0]),
+                    int(head[pos + 2:pos + 4].view(order + "u2")[0]),
+                    int(head[pos + 4:pos + 8].view(order + "u4")[0]))
+                if ftype not in TIFF_FIELD_TYPES:
+                    continue
+                vtype = order + TIFF_FIELD_TYPES[ftype]
+                size = np.dtype(vtype).itemsize * number
+                if size > 4:
+                    start = int(head[pos + 8:pos + 12].view(order + "u4")[0])
+                else:
+                    start = pos + 8
+                tags[tag] = [int(val) for val in
+                             head[start:start + size].view(vtype)]
+            width, height = tags[256][0], tags[257][0]
+            dtype = np.dtype(order + TIFF_TYPES[
+                (tags.get(258, [1])[0], tags.get(339, [1])[0])])
+            strips = list(zip(tags[273], tags[279]))
+        except (KeyError, IndexError, ValueError):
+            return None
+        if tags.get(259, [1])[0] != 1 or tags.get(277, [1])[0] != 1:
+            return None
+        return width, height, dtype, strips
+
+    def decode(self, data, header):
+        width, height, dtype, strips = header
+        count = width * height
+        first = strips[0][0]
+        if all(start == first + sum(size for dummy, size in strips[:i])
+               for i, (start, dummy) in enumerate(strips)):
+            # contiguous strips: just a view
+            image = np.frombuffer(data, dtype=dtype, count=count,
+                                  offset=first)
+        else:
+            image = np.concatenate([
+                np.frombuffer(data, dtype=dtype, offset=start,
+                              count=size // dtype.itemsize)
+                for start, size in strips])[:count]
+        return image.reshape(height, width)
+
+
+class NpyDecoder(FrameDecoder):
+    '''Numpy .npy arrays, only the small header is copied.'''
+
+    name = "npy"
+    magic = (b"\x93NUMPY",)
+    suffixes = (".npy",)
+
+    def probe(self, data, metadata):
+        head = np.frombuffer(data, dtype=np.uint8)
+        try:
+            if head[6] == 1:
+                start = 10 + int(head[8:10].view("<u2")[0])
+            else:
+                start = 12 + int(head[8:12].view("<u4")[0])
+            info = ast.literal_eval(
+                head[10 if head[6] == 1 else 12:start].tobytes().decode(
+                    "latin-1"))
+            dtype = np.dtype(info["descr"])
+            shape = tuple(info["shape"])
+        except (IndexError, KeyError, SyntaxError, TypeError, ValueError):
+            return None
+        if len(shape) != 2 or dtype.hasobject or \
+                start + int(np.prod(shape)) * dtype.itemsize > len(data):
+            return None
+        return start, dtype, shape, bool(info.get("fortran_order"))
+
+    def decode(self, data, header):
+        start, dtype, shape, fortran = header
+        image = np.frombuffer(data, dtype=dtype, offset=start,
+                              count=int(np.prod(shape)))
+        return image.reshape(shape, order="F" if fortran else "C")
+
+
+class DecoderRegistry(object):
+    '''Picks the decoder for a payload from its magic bytes and header.
+
+       For named streams (e.g. the signal host) the decoder and header of
+       the last fully probed frame are kept as decode plan, following
+       frames are only checked against it.'''
+
+    def __init__(self, decoders=None):
+        self.decoders = list(decoders or [])
+        # stream -> (decoder, header, payload size)
+        self._plans = {}
+
+    def register(self, decoder, first=False):
+        if first:
+            self.decoders.insert(0, decoder)
+        else:
+            self.decoders.append(decoder)
+
+    def get(self, name):
+        for decoder in self.decoders:
+            if decoder.name == name:
+                return decoder
+
+    def suffixes(self):
+        suffixes = []
+        for decoder in self.decoders:
+            suffixes.extend(
+                sfx for sfx in decoder.suffixes if sfx not in suffixes)
+        return suffixes
+
+    def find(self, data, metadata=None):
+        '''The matching decoder and its probe result, or None, None.'''
+        head = headBytes(data)
+        for decoder in self.decoders:
+            if decoder.magic and \
+                    not any(head.startswith(mgc) for mgc in decoder.magic):
+                continue
+            header = decoder.probe(data, metadata)
+            if header is not None:
+                return decoder, header
+        return None, None
+
+    def decode(self, data, metadata=None, stream=None):
+        return self.decodeFrame(data, metadata, stream)[0]
+
+    def decodeFrame(self, data, metadata=None, stream=None):
+        '''The image, the decoder and the header it was decoded with and
+           the orientation of the image, or None, None, None, None.'''
+        plan = self._plans.get(stream) if stream is not None else None
+        if plan is not None:
+            decoder, header, size = plan
+            header = decoder.check(data, metadata, header, size)
+            if header is not None:
+                output = decoder.output
+                image = decoder.run(data, header, output)
+                if image is not None:
+                    return image, decoder, header, output[0]
+            # the stream has changed: parse everything again
+            self._plans.pop(stream, None)
+
+        decoder, header = self.find(data, metadata)
+        if decoder is None:
+            return None, None, None, None
+        output = decoder.output
+        image = decoder.run(data, header, output)
+        if image is None:
+            return None, None, None, None
+        if stream is not None:
+            self._plans[stream] = (decoder, header, len(data))
+        return image, decoder, header, output[0]
+
+    def plan(self, stream):
+        '''The current decode plan of the stream or None.'''
+        return self._plans.get(stream)
+
+    def forgetPlans(self):
+        self._plans = {}
+
+    def setOutput(self, orientation=None, dtype=None):
+        for decoder in self.decoders:
+            decoder.setOutput(orientation, dtype)
+
+    def costs(self):
+        '''(name, frames, seconds per frame, seconds per MB) per decoder.'''
+        return [(decoder.name, decoder.frames) + decoder.cost()
+                for decoder in self.decoders]
+
+
+def defaultRegistry(pool=None):
+    return DecoderRegistry([CbfByteOffsetDecoder(pool), CbfNoneDecoder(pool),
+                            TiffDecoder(pool), NpyDecoder(pool),
+                            RawDecoder(pool)])
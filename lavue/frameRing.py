@@ -0,0 +1,133 @@
+# Copyright (C) 2017  Christoph Rosemann, DESY, Notkestr. 85, D-22607 Hamburg
+# email contact: christoph.rosemann@desy.de
+#
+# lavue is an image viewing program for photon science imaging detectors.
+# Its usual application is as a live viewer using hidra as data source.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation in  version 2
+# of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+
+# fixed depth ring of decoded frames between the fetching and gui threads
+
+import threading
+import time
+from collections import namedtuple
+
+FrameRecord = namedtuple(
+    "FrameRecord",
+    ["seq", "name", "image", "received", "stored", "orientation"])
+
+
+class FrameRing(object):
+    '''Bounded ring buffer of FrameRecords.
+
+       The producer adds frames with addFrame, it never waits for the
+       consumer: when the ring is full the oldest unread frame is
+       overwritten. The consumer reads either the newest frame
+       (readLatest, older unread ones are skipped) or the oldest unread
+       one (readNext). Every frame is handed out at most once; frames
+       which are overwritten or skipped before being read are counted
+       as dropped and their images passed to release. Images handed out
+       belong to the consumer.
+       The lock is only held while the slots are updated.'''
+
+    def __init__(self, depth=4, release=None):
+        self.depth = max(1, int(depth))
+        self._release = release
+        self._slots = [None] * self.depth
+        # slots holding a frame which has not been read yet
+        self._unread = [False] * self.depth
+        # how often every slot has been filled again
+        self.reuses = [0] * self.depth
+        self._lock = threading.Lock()
+        # number of frames added, and the first one not read or skipped
+        self._written = 0
+        self._read = 0
+        self.added = 0
+        self.dropped = 0
+
+    def addFrame(self, seq, name, image, received=None, orientation=None):
+        '''Store a frame, received is the time it arrived (default: now),
+           orientation the one it was decoded in (see frameDecoders).'''
+        stored = time.time()
+        record = FrameRecord(seq, name, image,
+                             stored if received is None else received, stored,
+                             orientation)
+        with self._lock:
+            slot = self._written % self.depth
+            lost = self._drop(slot)
+            if self._slots[slot] is not None:
+                self.reuses[slot] += 1
+            self._slots[slot] = record
+            self._unread[slot] = True
+            self._written += 1
+            self._read = max(self._read, self._written - self.depth)
+            self.added += 1
+        self._releaseAll(lost)
+
+    def readLatest(self):
+        '''The newest unread frame or None, skips older unread frames.'''
+        lost = []
+        with self._lock:
+            if self._read == self._written:
+                return None
+            for pos in range(self._read, self._written - 1):
+                lost.extend(self._drop(pos % self.depth))
+            record = self._take((self._written - 1) % self.depth)
+            self._read = self._written
+        self._releaseAll(lost)
+        return record
+
+    def readNext(self):
+        '''The oldest unread frame or None.'''
+        with self._lock:
+            if self._read == self._written:
+                return None
+            record = self._take(self._read % self.depth)
+            self._read += 1
+        return record
+
+    def pending(self):
+        '''Number of unread frames.'''
+        with self._lock:
+            return self._written - self._read
+
+    def clear(self):
+        '''Drop all unread frames.'''
+        with self._lock:
+            lost = []
+            for slot in range(self.depth):
+                lost.extend(self._drop(slot))
+            self._read = self._written
+        self._releaseAll(lost)
+
+    def _take(self, slot):
+        # the slot keeps no reference to images handed out or dropped
+        record = self._slots[slot]
+        self._slots[slot] = record._replace(image=None)
+        self._unread[slot] = False
+        return record
+
+    def _drop(self, slot):
+        # an unread frame of the slot is lost, returns its image to release
+        if not self._unread[slot]:
+            return []
+        self.dropped += 1
+        return [self._take(slot).image]
+
+    def _releaseAll(self, images):
+        if self._release is not None:
+            for image in images:
+                self._release(image)
@@ -0,0 +1,170 @@
+# Copyright (C) 2017  Christoph Rosemann, DESY, Notkestr. 85, D-22607 Hamburg
+# email contact: christoph.rosemann@desy.de
+#
+# lavue is an image viewing program for photon science imaging detectors.
+# Its usual application is as a live viewer using hidra as data source.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation in  version 2
+# of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+
+# statistics of a frame in one pass and per-pixel statistics over frames
+
+import threading
+import numpy as np
+
+from . import bufferPool
+
+# pixels per chunk, the float64 copy of a chunk stays in the cache
+CHUNKPIXELS = 1 << 16
+
+# scratch buffers of the calling thread
+_pool = bufferPool.BufferPool()
+
+
+def subsampleStep(shape, maxPixels=None):
+    '''The stride in both directions to get at most maxPixels.'''
+    if not maxPixels:
+        return 1
+    step = 1
+    while int(np.prod([(dim + step - 1) // step for dim in shape])) > \
+            maxPixels:
+        step += 1
+    return step
+
+
+def frameStats(image, mask=None, step=1, pool=None):
+    '''Number of pixels, min, max, sum, sum of squares, mean and variance
+       of image. The frame is read once, in chunks of rows that are
+       reduced while they are in the cache. Masked (non-zero) pixels of
+       mask are left out, a mask of another shape is not applied. With
+       step > 1 only every step-th pixel of every step-th row counts.'''
+    image = np.asarray(image)
+    if mask is not None:
+        mask = np.asarray(mask)
+        if mask.shape != image.shape:
+            mask = None
+    if image.ndim != 2:
+        shape = (-1, image.shape[-1]) if image.ndim else (1, 1)
+        image = image.reshape(shape)
+        if mask is not None:
+            mask = mask.reshape(shape)
+    if step > 1:
+        image = image[::step, ::step]
+        if mask is not None:
+            mask = mask[::step, ::step]
+    pool = pool or _pool
+    rows = max(1, CHUNKPIXELS // max(1, image.shape[1]))
+    pixels, low, high, total, squares = 0, None, None, 0., 0.
+    for top in range(0, image.shape[0], rows):
+        chunk = image[top:top + rows]
+        values = pool.getScratch("stats", chunk.size, np.float64)
+        np.copyto(values.reshape(chunk.shape), chunk)
+        if mask is not None:
+            values = values[mask[top:top + rows].ravel() == 0]
+            if not values.size:
+                continue
+        pixels += values.size
+        cmin, cmax = values.min(), values.max()
+        low = cmin if low is None else min(low, cmin)
+        high = cmax if high is None else max(high, cmax)
+        total += values.sum()
+        squares += np.dot(values, values)
+    stats = {"pixels": int(pixels)}
+    if pixels:
+        mean = total / pixels
+        stats.update({"min": float(low), "max": float(high),
+                      "sum": float(total), "sumsq": float(squares),
+                      "mean": float(mean),
+                      "var": float(max(squares / pixels - mean * mean, 0.))})
+    return stats
+
+
+class RunningStats(object):
+    '''Per-pixel mean and variance over all frames given to update, with
+       the Welford update in float32. A frame of another shape starts
+       over.'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.count = 0
+            self._mean = None
+            self._squares = None
+            self._delta = None
+            self._scratch = None
+
+    def update(self, image):
+        with self._lock:
+            if self._mean is None or self._mean.shape != image.shape:
+                self.count = 0
+                self._mean = np.zeros(image.shape, dtype=np.float32)
+                self._squares = np.zeros(image.shape, dtype=np.float32)
+                self._delta = np.empty(image.shape, dtype=np.float32)
+                self._scratch = np.empty(image.shape, dtype=np.float32)
+            self.count += 1
+            # mean += delta / count; squares += delta * (image - mean)
+            delta = np.subtract(image, self._mean, out=self._delta)
+            scratch = np.divide(delta, np.float32(self.count),
+                                out=self._scratch)
+            np.add(self._mean, scratch, out=self._mean)
+            np.subtract(image, self._mean, out=scratch)
+            np.multiply(delta, scratch, out=scratch)
+            np.add(self._squares, scratch, out=self._squares)
+
+    def mean(self):
+        '''Copy of the per-pixel mean, None before the first frame.'''
+        with self._lock:
+            return None if self._mean is None else self._mean.copy()
+
+    def variance(self, ddof=0):
+        '''Copy of the per-pixel variance, None without enough frames.'''
+        with self._lock:
+            if self._squares is None or self.count <= ddof:
+                return None
+            return self._squares / np.float32(self.count - ddof)
+
+
+class RunningMean(object):
+    '''Per-pixel float32 mean of the next frames given to update, e.g. a
+       dark image. update returns True once frames frames were added.'''
+
+    def __init__(self, frames):
+        self.frames = max(1, int(frames))
+        self.count = 0
+        self._mean = None
+        self._scratch = None
+
+    def update(self, image):
+        if self._mean is None or self._mean.shape != image.shape:
+            self.count = 0
+            self._mean = np.zeros(image.shape, dtype=np.float32)
+            self._scratch = np.empty(image.shape, dtype=np.float32)
+        if self.count < self.frames:
+            self.count += 1
+            # mean += (image - mean) / count
+            scratch = np.subtract(image, self._mean, out=self._scratch)
+            np.divide(scratch, np.float32(self.count), out=scratch)
+            np.add(self._mean, scratch, out=self._mean)
+        return self.done()
+
+    def done(self):
+        return self.count >= self.frames
+
+    def mean(self):
+        '''The mean so far, None before the first frame.'''
+        return self._mean
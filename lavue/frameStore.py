@@ -0,0 +1,99 @@
+# Copyright (C) 2017  Christoph Rosemann, DESY, Notkestr. 85, D-22607 Hamburg
+# email contact: christoph.rosemann@desy.de
+#
+# lavue is an image viewing program for photon science imaging detectors.
+# Its usual application is as a live viewer using hidra as data source.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation in  version 2
+# of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+
+# compressed cbf frames kept for re-decoding regions of them
+
+import collections
+import threading
+
+import numpy as np
+
+from . import cbfCodec
+from . import frameDecoders
+
+
+class CbfFrameStore(object):
+    '''Keeps the last depth byte offset compressed frames, in memory or
+       mapped from their files, with a row checkpoint index each.
+
+       The index is built when a frame is added, from the image decoded
+       anyway; region re-decodes only the rows it needs, e.g. for a
+       zoomed in area or a line cut of an older frame.'''
+
+    def __init__(self, depth=8, every=cbfCodec.ROWCHECKPOINTS):
+        self.depth = depth
+        self.every = every
+        # name -> (binary section, RowIndex)
+        self._frames = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, name, data, image=None, orientation=None, header=None):
+        '''Keep the cbf payload data under name. image is the decoded
+           frame in the given orientation (see frameDecoders), without it
+           the frame is decoded once. header is the CbfHeader of data if
+           known, otherwise it is parsed. The payload is referenced, not
+           copied. Returns False for other formats.'''
+        if header is None:
+            if not frameDecoders.headBytes(data).startswith(b"###CBF"):
+                return False
+            header = cbfCodec.parseCbfHeader(data)
+        if header is None or header.compression != cbfCodec.BYTE_OFFSET \
+                or None in (header.fastDim, header.slowDim):
+            return False
+        stream = np.frombuffer(
+            data, dtype=np.uint8, offset=header.binaryStart,
+            count=header.binaryStop - header.binaryStart)
+        if image is not None:
+            image = frameDecoders.orientView(image, orientation, inverse=True)
+        # converted values are no use as checkpoints
+        if image is None or image.dtype != np.int32 or \
+                image.shape != (header.slowDim, header.fastDim):
+            image = cbfCodec.decompress(stream)
+        index = cbfCodec.buildRowIndex(
+            stream, image, header.fastDim, header.slowDim, self.every)
+        with self._lock:
+            self._frames.pop(name, None)
+            self._frames[name] = (stream, index)
+            while len(self._frames) > self.depth:
+                self._frames.popitem(last=False)
+        return True
+
+    def addFile(self, fname, name=None):
+        '''Keep a cbf file, it is mapped and only read where decoded.'''
+        return self.add(name or fname, np.memmap(fname, mode="r"))
+
+    def names(self):
+        with self._lock:
+            return list(self._frames)
+
+    def region(self, name, top=0, bottom=None, left=0, right=None):
+        '''Rows top:bottom and columns left:right of a kept frame as
+           (slow, fast) int32 array, None for unknown frames.'''
+        with self._lock:
+            frame = self._frames.get(name)
+        if frame is None:
+            return None
+        return cbfCodec.decodeRegion(frame[0], frame[1], top, bottom,
+                                     left, right)
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
@@ -0,0 +1,325 @@
+# Copyright (C) 2017  Christoph Rosemann, DESY, Notkestr. 85, D-22607 Hamburg
+# email contact: christoph.rosemann@desy.de
+#
+# lavue is an image viewing program for photon science imaging detectors.
+# Its usual application is as a live viewer using hidra as data source.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation in  version 2
+# of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+
+# processing of frames without a gui, e.g. for unattended monitoring:
+#
+#   python -m lavue.headless --source hidra --server <signal host>
+#
+# writes one line of statistics per frame; nothing here imports Qt
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from . import cbfCodec
+from . import dataSource
+from . import decodePool
+from . import frameDecoders
+from . import frameStatistics
+from . import imagePipeline
+from . import pipelineMetrics
+
+# columns of the per-frame statistics
+STATFIELDS = ("frame", "name", "received", "pixels", "min", "max", "mean",
+              "var", "sum")
+
+
+def loadImage(fname):
+    '''An image file in any of the frame formats as (slow, fast) array.'''
+    with open(fname, "rb") as imagefile:
+        data = imagefile.read()
+    image = frameDecoders.defaultRegistry().decode(data)
+    if image is None:
+        raise ValueError("Unknown image format: %s" % fname)
+    return np.array(image)
+
+
+class FrameProcessor(object):
+    '''Dark and flat-field correction (raw - dark) * gain, background
+       subtraction, masking and statistics of a frame.
+       mask is True (non-zero) for the pixels to leave out. A dark, gain,
+       background or mask of another shape than the frame is not
+       applied. Frames
+       larger than maxPixels are subsampled for the statistics. With
+       running = True the per-pixel mean and variance over all processed
+       frames are kept in self.running.'''
+
+    def __init__(self, background=None, mask=None, maxPixels=None,
+                 running=False, dark=None, gain=None):
+        # the decoding threads run it at the same time: the scratch
+        # buffers of the pipeline belong to the calling thread
+        self.pipeline = imagePipeline.ImagePipeline([
+            imagePipeline.CorrectionStage(dark, gain),
+            imagePipeline.BackgroundStage(background),
+            imagePipeline.StatsStage(mask, maxPixels=maxPixels)])
+        self.running = frameStatistics.RunningStats() if running else None
+
+    def process(self, image):
+        '''The processed frame and a dict of its statistics. The frame
+           is only valid until the next call in the same thread.'''
+        frame, info = self.pipeline.run(image)
+        if self.running is not None:
+            self.running.update(frame)
+        return frame, info["stats"]
+
+    def saveRunning(self, prefix):
+        '''Writes the per-pixel mean and variance as prefix_mean.npy and
+           prefix_var.npy, if there were any frames.'''
+        if self.running is None or self.running.mean() is None:
+            return
+        np.save(prefix + "_mean.npy", self.running.mean())
+        np.save(prefix + "_var.npy", self.running.variance())
+
+
+class HeadlessRunner(object):
+    '''Receives frames from a data source, decodes them in a DecodePool
+       and writes the statistics of every processed frame as json or csv
+       line to output. Every saveEvery-th processed frame is stored as
+       .npy file in saveDir.'''
+
+    def __init__(self, source, processor=None, output=sys.stdout,
+                 fmt="json", workers=2, policy="ordered", metrics=None,
+                 saveDir=None, saveEvery=0):
+        if fmt not in ("json", "csv"):
+            raise ValueError("Unknown output format: %s" % fmt)
+        self.source = source
+        self.processor = processor or FrameProcessor()
+        self.output = output
+        self.fmt = fmt
+        self.metrics = metrics or pipelineMetrics.PipelineMetrics()
+        self.saveDir = saveDir
+        self.saveEvery = saveEvery
+        self.processed = 0
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self.decodePool = decodePool.DecodePool(
+            source.decode, self.deliver, workers, policy,
+            release=source.releaseData, discard=source.discard)
+
+    def run(self, frames=None, duration=None):
+        '''Process frames until stop, or until the given number of frames
+           was received or seconds passed.'''
+        if not self.source.connect():
+            raise RuntimeError("Cannot connect to %s" % self.source.getTarget())
+        if self.fmt == "csv":
+            self._write(",".join(STATFIELDS))
+        end = None if duration is None else time.time() + duration
+        received = 0
+        self._stopped.clear()
+        self.decodePool.start()
+        try:
+            while not self._stopped.is_set():
+                if frames is not None and received >= frames:
+                    break
+                if end is not None and time.time() > end:
+                    break
+                data, metadata = self.source.receive()
+                if data is not None:
+                    received += 1
+                    self.metrics.count("received")
+                    self.decodePool.submit(
+                        metadata["filename"], data, metadata)
+            self.decodePool.drain()
+        finally:
+            self.decodePool.stop()
+            self.source.close()
+
+    def stop(self):
+        self._stopped.set()
+
+    def deliver(self, seq, name, image, received):
+        # called by the decoding threads, in order
+        self.metrics.count("decoded")
+        self.metrics.latency("decode", time.time() - received)
+        start = time.time()
+        try:
+            frame, stats = self.processor.process(image)
+            stats.update({"frame": seq, "name": name,
+                          "received": round(received, 6)})
+            with self._lock:
+                self.processed += 1
+                if self.saveDir and self.saveEvery and \
+                        self.processed % self.saveEvery == 0:
+                    np.save(os.path.join(
+                        self.saveDir, os.path.splitext(os.path.basename(
+                            str(name)))[0] + ".npy"), frame)
+                if self.fmt == "json":
+                    self._write(json.dumps(stats, sort_keys=True))
+                else:
+                    self._write(",".join(
+                        "" if stats.get(key) is None else str(stats[key])
+                        for key in STATFIELDS))
+        finally:
+            # without a background the frame is the image itself
+            self.source.releaseData(image)
+        self.metrics.count("processed")
+        self.metrics.latency("process", time.time() - start)
+        self.metrics.latency("total", time.time() - received)
+
+    def _write(self, line):
+        try:
+            self.output.write(line + "\n")
+            self.output.flush()
+        except (IOError, OSError):
+            # e.g. the reading end of a pipe is gone
+            self.stop()
+
+
+def sourceOptions(options):
+    '''Constructor options of the data source from the command line.'''
+    if options.source == "directory":
+        return {"path": options.directory}
+    if options.source == "replay":
+        return {"path": None if options.shape else options.directory,
+                "shape": options.shape, "rate": options.rate,
+                "burst": options.burst, "jitter": options.jitter,
+                "loop": not options.no_loop}
+    return {}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Frame statistics of a detector without a gui.")
+    parser.add_argument(
+        "--source", default="hidra", choices=sorted(dataSource.SOURCES),
+        help="where the frames come from (default: %(default)s)")
+    parser.add_argument("--server", help="signal host of the hidra source")
+    parser.add_argument(
+        "--directory", default="/ramdisk/",
+        help="directory of the directory or replay source "
+        "(default: %(default)s)")
+    parser.add_argument(
+        "--shape", type=int, nargs=2, metavar=("SLOW", "FAST"),
+        help="replay synthetic frames of this shape")
+    parser.add_argument("--rate", type=float, default=10.,
+                        help="replayed frames per second (default: %(default)s)")
+    parser.add_argument("--burst", type=int, default=1,
+                        help="replayed frames sent at once (default: %(default)s)")
+    parser.add_argument("--jitter", type=float, default=0.,
+                        help="random shift of the replayed frames in periods")
+    parser.add_argument("--no-loop", action="store_true",
+                        help="stop the replay after the last frame")
+    parser.add_argument("--background", metavar="FILE",
+                        help="image subtracted from every frame")
+    parser.add_argument("--dark", metavar="FILE",
+                        help="averaged dark image subtracted from every "
+                        "frame, e.g. PREFIX_mean.npy of --running-stats")
+    parser.add_argument("--flat", metavar="FILE",
+                        help="flat-field gain map the frames are "
+                        "multiplied with after the dark subtraction")
+    parser.add_argument("--mask", metavar="FILE",
+                        help="image, non-zero pixels are left out")
+    parser.add_argument("--output", default="-", metavar="FILE",
+                        help="statistics file, - for stdout (default)")
+    parser.add_argument("--format", default="json", choices=("json", "csv"),
+                        help="json object or csv row per frame "
+                        "(default: %(default)s)")
+    parser.add_argument("--frames", type=int,
+                        help="stop after this many frames")
+    parser.add_argument("--duration", type=float,
+                        help="stop after this many seconds")
+    parser.add_argument("--save-dir", metavar="DIR",
+                        help="directory for processed frames as .npy")
+    parser.add_argument("--save-every", type=int, default=0, metavar="N",
+                        help="save every N-th processed frame")
+    parser.add_argument("--stats-max-pixels", type=int, metavar="N",
+                        help="subsample larger frames for the statistics")
+    parser.add_argument("--running-stats", metavar="PREFIX",
+                        help="write the per-pixel mean and variance over "
+                        "all frames to PREFIX_mean.npy and PREFIX_var.npy")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="append pipeline metrics every second to FILE")
+    parser.add_argument(
+        "--decode-workers", type=int, default=2,
+        help="number of frame decoding threads (default: %(default)s)")
+    parser.add_argument(
+        "--delivery-policy", default="ordered",
+        choices=decodePool.DecodePool.POLICIES,
+        help="'ordered' processes all frames, 'latest' drops stale ones "
+        "(default: %(default)s)")
+    parser.add_argument(
+        "--cbf-backend", default="auto", choices=("auto",) + cbfCodec.BACKENDS,
+        help="CBF decoder, 'auto' picks the fastest correct one")
+    parser.add_argument("--timeout", type=int, default=500,
+                        help="longest wait for a frame in ms (default: %(default)s)")
+    options = parser.parse_args(argv)
+
+    backend, dummy = cbfCodec.selectBackend(options.cbf_backend)
+    print("[lavue headless] cbf backend: %s" % backend, file=sys.stderr)
+
+    source = dataSource.createSource(
+        options.source, timeout=options.timeout, **sourceOptions(options))
+    if hasattr(source, "setSignalHost"):
+        if not options.server:
+            parser.error("the hidra source needs --server")
+        source.setSignalHost(options.server)
+    processor = FrameProcessor(
+        loadImage(options.background) if options.background else None,
+        loadImage(options.mask) if options.mask else None,
+        options.stats_max_pixels, options.running_stats is not None,
+        loadImage(options.dark) if options.dark else None,
+        loadImage(options.flat) if options.flat else None)
+
+    output = sys.stdout
+    if options.output != "-":
+        output = open(options.output, "a")
+    runner = HeadlessRunner(
+        source, processor, output, options.format, options.decode_workers,
+        options.delivery_policy, saveDir=options.save_dir,
+        saveEvery=options.save_every)
+
+    reporter = None
+    if options.metrics:
+        reporter = pipelineMetrics.MetricsReporter(
+            runner.metrics, options.metrics)
+        timer = threading.Thread(target=_reportMetrics,
+                                 args=(reporter, runner))
+        timer.daemon = True
+        timer.start()
+    try:
+        runner.run(options.frames, options.duration)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        runner.stop()
+        if options.running_stats:
+            processor.saveRunning(options.running_stats)
+        if reporter is not None:
+            reporter.report()
+            reporter.close()
+        if output is not sys.stdout:
+            output.close()
+
+
+def _reportMetrics(reporter, runner, interval=1.):
+    while not runner._stopped.wait(interval):
+        reporter.report()
+
+
+if __name__ == "__main__":
+    main()
@@ -28,13 +28,22 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import sys
+import threading
 import time
 import socket
 import numpy as np
 
 from PyQt4 import QtCore, QtGui
 
-from . import hidra_cbf_source as hcs
+from . import dataSource
+from . import cbfCodec
+from . import frameDecoders
+from . import decodePool
+from . import displayScheduler
+from . import frameRing
+from . import frameStatistics
+from . import imagePipeline
+from . import pipelineMetrics
 from . import GradientItem as GI
 
 from . import gradientChoiceWidget
@@ -43,6 +52,7 @@ from . import imageWidget
 from . import intensityScalingWidget
 from . import levelsWidget
 from . import statisticsWidget
+from . import metricsWidget
 from . import preparationBoxWidget
 from . import imageFileHandler
 try:
@@ -52,74 +62,160 @@ except:
     print("Alternate method not yet implemented.")
 
 # magic numbers:
-GLOBALREFRESHRATE = .1  # refresh rate if the data source is running in seconds
+GLOBALREFRESHRATE = .1  # retry interval in seconds after a failed receive
+RECEIVETIMEOUT = 500  # longest wait of the data source for a frame in ms
+MINRECEIVETIME = .005  # receives returning faster without data have failed
+DECODEWORKERS = 2  # number of threads decoding the received frames
+DELIVERYPOLICY = "latest"  # "latest": drop stale frames, "ordered": show all
+CBFBACKEND = "auto"  # cbf decoding: "fabio", "numpy", "loop" or fastest
+SOURCE = "hidra"  # kind of data source, a key of dataSource.SOURCES
+KEEPFRAMES = 0  # compressed cbf frames kept for re-decoding regions
+FRAMERINGDEPTH = 4  # decoded frames waiting for the display
+DISPLAYRATE = 25.  # most redraws per second, 0: every frame
+METRICSINTERVAL = 1.  # seconds between two updates of the pipeline metrics
+STATSMAXPIXELS = None  # larger frames are subsampled for the statistics
+
+# orientation the frames are decoded in for each transformation,
+# see imagePipeline.TRANSFORMATIONS for the mismatch of the names
+TRAFOORIENTATIONS = {"None": None,
+                     "flipud": "fliplr",
+                     "rotate90": "rot90",
+                     "mirror": "flipud"}
+
+
+def selectCbfBackend(cbfBackend=CBFBACKEND):
+    '''Select the cbf decoding backend and report the choice.'''
+    backend, timings = cbfCodec.selectBackend(cbfBackend)
+    print("[cbf codec] using the %s backend" % backend)
+    for name in sorted(timings):
+        print("[cbf codec]   %s: %s" % (name, "wrong results"
+              if timings[name] is None else "%.2f ms per 300k frame"
+              % (1000. * timings[name])))
+    return backend
 
 
 class HidraLiveViewer(QtGui.QDialog):
     '''The master class for the dialog, contains all other widget and handles communication.'''
 
-    # subclass for data caching
-    class exchangeList(list):
-        def __init__(self,*args):
-            list.__init__(self, *args)
-            self.mute = False
-            self.append(None)
-            self.append(None)
-
-        def addData(self, name, data):
-            if self.mute is False:
-                self.mute = True
-                self[0] = name
-                self[1] = data
-                self.mute = False
-            else:
-                pass # print(" MUTED ACCESS IS NOT POSSIBLE")
-
-        def readData(self):
-            if self.mute is False:
-                self.mute = True
-                a, b = self[0], self[1]
-                self.mute = False
-                return a, b
-            else:
-               print("MUTED ACCESS IS NOT POSSIBLE")
+    # emitted by a decoding thread once the dark image is complete
+    darkTaken = QtCore.pyqtSignal()
 
     # subclass for threading
     class dataFetchThread(QtCore.QThread):
         newDataName = QtCore.pyqtSignal(str)
 
-        def __init__(self, datasource, alist):
+        def __init__(self, datasource, ring, workers=DECODEWORKERS,
+                     policy=DELIVERYPOLICY, metrics=None, group=None):
             QtCore.QThread.__init__(self)
             self.data_source = datasource
-            self._list = alist
-            self._isConnected = False
-            
+            self._ring = ring
+            self.metrics = metrics or pipelineMetrics.PipelineMetrics()
+            # called with (name, image, orientation) for every decoded
+            # frame, displayed or not; the image must not be kept. The
+            # list is replaced, not changed, see addObserver
+            self.observers = []
+            # set while a newDataName signal waits for the gui
+            self._signalled = threading.Event()
+            # set while connected, the loop is parked otherwise
+            self._connected = threading.Event()
+            self._stopped = threading.Event()
+            # receiving stays here, decoding runs in the pool; every
+            # image comes with the orientation it was decoded in
+            self.decodePool = decodePool.DecodePool(
+                self.data_source.decodeOriented, self.deliver, workers,
+                policy,
+                release=lambda frame: self.data_source.releaseData(frame[0]),
+                group=group, discard=self.data_source.discard)
+
         def run(self):
-            while(True):    
-                time.sleep(GLOBALREFRESHRATE)
-                if(self._isConnected):
-                     img, name = self.data_source.getData()
-                     if name is not None:
-                        self._list.addData(name, img)
-                        self.newDataName.emit(name)
-                else:
-                    pass
+            self._stopped.clear()
+            self.decodePool.start()
+            try:
+                while not self._stopped.is_set():
+                    # parked without a connection, wakes up on changeStatus
+                    # and stop
+                    self._connected.wait()
+                    if self._stopped.is_set():
+                        break
+                    # blocks until a frame arrives or the source times out
+                    start = time.time()
+                    data, metadata = self.data_source.receive()
+                    if data is not None:
+                        self.metrics.count("received")
+                        self.decodePool.submit(
+                            metadata["filename"], data, metadata)
+                    elif time.time() - start < MINRECEIVETIME:
+                        # the source failed without waiting, do not spin
+                        self._stopped.wait(GLOBALREFRESHRATE)
+            finally:
+                self.decodePool.stop()
+
+        def deliver(self, seq, name, frame, received):
+            # called by the decoding threads, in the order of the policy
+            img, orientation = frame
+            self.metrics.count("decoded")
+            self.metrics.latency("decode", time.time() - received)
+            for observer in self.observers:
+                observer(name, img, orientation)
+            self._ring.addFrame(seq, name, img, received, orientation)
+            # one signal at a time, the gui reads the newest frame anyway
+            if not self._signalled.is_set():
+                self._signalled.set()
+                self.newDataName.emit(name)
+
+        def addObserver(self, observer):
+            self.observers = self.observers + [observer]
+
+        def removeObserver(self, observer):
+            self.observers = [obs for obs in self.observers
+                              if obs != observer]
+
+        def countLosses(self):
+            # frames lost before or after decoding, the latter are the
+            # ones replaced by newer frames before they were drawn
+            self.metrics.setCount(
+                "dropped", self.decodePool.dropped + self.decodePool.failed)
+            self.metrics.setCount("skipped", self._ring.dropped)
+
+        def signalReceived(self):
+            # the next frame is signalled again
+            self._signalled.clear()
 
         def changeStatus(self, status):
-            self._isConnected = status
-
-
-    def __init__(self, parent=None, signal_host=None, target=None):
+            if status:
+                self._connected.set()
+            else:
+                self._connected.clear()
+
+        def stop(self):
+            '''End the loop and wait for it, a pending receive finishes
+               within the timeout of the source.'''
+            self._stopped.set()
+            self._connected.set()
+            self.wait()
+            self._connected.clear()
+
+    def __init__(self, parent=None, signal_host=None, target=None,
+                 decodeWorkers=DECODEWORKERS, deliveryPolicy=DELIVERYPOLICY,
+                 cbfBackend=CBFBACKEND, source=SOURCE, sourceOptions=None,
+                 displayRate=DISPLAYRATE, metricsFile=None,
+                 metricsFormat="json", decodeGroup=None, embedded=False,
+                 keepFrames=KEEPFRAMES):
         super(HidraLiveViewer, self).__init__(parent)
 
         self.setAttribute(QtCore.Qt.WA_DeleteOnClose)
+        if embedded:
+            # a pane of the multi detector viewer instead of a window
+            self.setWindowFlags(QtCore.Qt.Widget)
 
-        # instantiate the data source
-        # here: hardcoded the hidra cbf source!
-        # future possibility: use abstract interface and factory for concrete instantiation
+        # instantiate the data source, see dataSource.SOURCES
+        # note: for hidra host and target are defined in another place
+        options = dict(timeout=RECEIVETIMEOUT, keepFrames=keepFrames)
+        options.update(sourceOptions or {})
+        self.data_source = dataSource.createSource(source, **options)
 
-        # note: host and target are defined in another place
-        self.data_source = hcs.HiDRA_cbf_source()
+        # the fastest correct cbf decoder unless chosen explicitly
+        selectCbfBackend(cbfBackend)
 
         # WIDGET DEFINITIONS
         # instantiate the widgets and declare the parent
@@ -129,26 +225,54 @@ class HidraLiveViewer(QtGui.QDialog):
         self.levelsW = levelsWidget.LevelsWidget(parent=self)
         self.gradientW = gradientChoiceWidget.GradientChoiceWidget(parent=self)
         self.statsW = statisticsWidget.StatisticsWidget(parent=self)
+        self.metricsW = metricsWidget.MetricsWidget(parent=self)
         self.imageW = imageWidget.ImageWidget(parent=self)
 
         
         #~ self.maskW = self.prepBoxW.maskW
         self.bkgSubW = self.prepBoxW.bkgSubW
+        self.darkFlatW = self.prepBoxW.darkFlatW
         self.trafoW = self.prepBoxW.trafoW
 
         # keep a reference to the "raw" image and the current filename
         self.raw_image = None
+        # the orientation the raw image was decoded in, see TRAFOORIENTATIONS
+        self.raw_orientation = None
         self.image_name = None
         self.display_image = None
 
         self.background_image = None
+        # the background as decoded without any transformation
+        self.background_unoriented = None
         self.doBkgSubtraction = False
+        # orientation background, dark and gain are given to the pipeline in
+        self.mapsOrientation = None
+
+        # averaged dark image and flat-field gain map, untransformed
+        self.dark_unoriented = None
+        self.gain_unoriented = None
+        # running mean of the decoded frames while a dark image is taken,
+        # updated by the decoding threads
+        self.darkAccumulator = None
+        self.darkLock = threading.Lock()
+        self.doCorrection = False
         
         self.mask_image = None
         self.maskIndices = None
         self.applyImageMask = False
 
         self.trafoName = "None"
+        # in place preprocessing of every frame before it is displayed;
+        # the stage outputs are cached, a change of the levels or the
+        # scaling only redoes what comes after
+        self.pipeline = imagePipeline.ImagePipeline(cache=True)
+        self.pipeline.get("stats").maxPixels = STATSMAXPIXELS
+        # identifies the content of the raw image for the cache
+        self.frameCount = 0
+        self.scale(self.scalingW.getCurrentScaling())
+        self.stageTimings = {}
+        # the data source can decode directly into the transformed layout
+        self.orientOnDecode = hasattr(self.data_source, "setOutput")
         
         # LAYOUT DEFINITIONS
         # the dialog layout is side by side
@@ -167,6 +291,7 @@ class HidraLiveViewer(QtGui.QDialog):
         vlayout.addWidget(self.levelsW)
         vlayout.addWidget(self.gradientW)
         vlayout.addWidget(self.statsW)
+        vlayout.addWidget(self.metricsW)
 
         # then the vertical layout on the --global-- horizontal one
         globallayout.addLayout(vlayout, 1)
@@ -198,19 +323,51 @@ class HidraLiveViewer(QtGui.QDialog):
         # gradient selector
         self.gradientW.chosenGradient.connect(self.imageW.changeGradient)
 
-        # simple mutable caching object for data exchange with thread
-        # [blocked state | image name | image data]
-        # during read+write access state is set to blocked to avoid conflict
-        self.exchangelist = self.exchangeList()
-        
-        self.dataFetcher = self.dataFetchThread(self.data_source, self.exchangelist)
+        self.imageW.saveImage.connect(self.saveCurrentImage)
+
+        # decoded frames on their way from the fetching thread, frames
+        # never displayed go back to the data source
+        self.frameRing = frameRing.FrameRing(
+            FRAMERINGDEPTH, release=self.data_source.releaseData)
+
+        # frame counters and latencies, shown and optionally written
+        # every METRICSINTERVAL seconds
+        self.metrics = pipelineMetrics.PipelineMetrics()
+        self.metricsReporter = None
+        if metricsFile is not None:
+            self.metricsReporter = pipelineMetrics.MetricsReporter(
+                self.metrics, sys.stdout if metricsFile == "-" else metricsFile,
+                metricsFormat)
+        self.metricsTimer = QtCore.QTimer(self)
+        self.metricsTimer.timeout.connect(self.updateMetrics)
+        self.metricsTimer.start(int(1000 * METRICSINTERVAL))
+
+        self.dataFetcher = self.dataFetchThread(
+            self.data_source, self.frameRing, decodeWorkers, deliveryPolicy,
+            self.metrics, decodeGroup)
         self.dataFetcher.newDataName.connect(self.getNewData)
+
+        # frames are drawn at most displayRate times per second, the
+        # newest one wins; without a limit or with the "ordered" policy
+        # every frame is drawn in turn, as long as the ring holds it
+        self.displayScheduler = displayScheduler.DisplayScheduler(displayRate)
+        self.drawAll = (not self.displayScheduler.rate
+                        or deliveryPolicy == "ordered")
+        self.displayTimer = QtCore.QTimer(self)
+        self.displayTimer.setSingleShot(True)
+        self.displayTimer.timeout.connect(self.showLatest)
         # ugly !!! sent current state to the data fetcher...
         self.hidraW.hidra_state.connect(self.dataFetcher.changeStatus)
+        self.darkTaken.connect(self.finishDark)
         
         self.bkgSubW.bkgFileSelection.connect(self.prepareBKGSubtraction)
         self.bkgSubW.useCurrentImageAsBKG.connect(self.setCurrentImageAsBKG)
         self.bkgSubW.applyBkgSubtractBox.stateChanged.connect(self.checkBKGSubtraction)
+        self.darkFlatW.takeDark.connect(self.startDark)
+        self.darkFlatW.darkFileSelection.connect(self.loadDark)
+        self.darkFlatW.darkFileSave.connect(self.saveDark)
+        self.darkFlatW.flatFileSelection.connect(self.loadFlat)
+        self.darkFlatW.applyCorrectionBox.stateChanged.connect(self.checkCorrection)
         #~ self.maskW.maskFileSelection.connect(self.prepareMasking)
         #~ self.maskW.applyMaskBox.stateChanged.connect(self.checkMasking)
 
@@ -218,22 +375,20 @@ class HidraLiveViewer(QtGui.QDialog):
         self.trafoW.activatedTransformation.connect(self.assessTransformation)
 
         # set the right target name for the hidra display at initialization
-        self.hidraW.setTargetName(self.data_source.getTarget())
-        self.hidraW.hidra_servername.connect(self.data_source.setSignalHost)
+        if hasattr(self.data_source, "setSignalHost"):
+            self.hidraW.setTargetName(self.data_source.getTarget())
+            self.hidraW.hidra_servername.connect(
+                self.data_source.setSignalHost)
+        else:
+            # sources without a server to choose
+            self.hidraW.setSingleSource(
+                source, self.data_source.getTarget())
 
     def plot(self):
         """ The main command of the live viewer class: draw a numpy array with the given name."""
-        # prepare or preprocess the raw image if present:
-        self.prepareImage()
-        
-        # perform transformation 
-        self.transform()
-        
-        # use the internal raw image to create a display image with chosen scaling
-        self.scale(self.scalingW.getCurrentScaling())
-
-        # calculate the stats for this
-        maxVal, meanVal, varVal, minVal = self.calcStats()
+        start = time.time()
+        # background, mask, transformation, scaling and statistics
+        maxVal, meanVal, varVal, minVal = self.processImage()
 
         # update the statistics display
         self.statsW.update_stats(meanVal, maxVal, varVal, self.scalingW.getCurrentScaling())
@@ -243,7 +398,10 @@ class HidraLiveViewer(QtGui.QDialog):
             self.levelsW.updateLevels(float(minVal), float(maxVal))
 
         # calls internally the plot function of the plot widget
+        processed = time.time()
         self.imageW.plot(self.display_image, self.image_name)
+        # seconds spent on processing and drawing
+        self.plotTiming = (processed - start, time.time() - processed)
 
     # mode changer: start plotting mode
     def startPlotting(self):
@@ -257,6 +415,22 @@ class HidraLiveViewer(QtGui.QDialog):
         if self.dataFetcher is not None:
             pass
 
+    def updateMetrics(self):
+        self.dataFetcher.countLosses()
+        snap = self.metrics.snapshot()
+        self.metricsW.update_metrics(snap)
+        if self.metricsReporter is not None:
+            self.metricsReporter.report(snap)
+
+    def closeEvent(self, event):
+        # the fetching thread must not outlive the dialog
+        self.metricsTimer.stop()
+        self.dataFetcher.stop()
+        if self.metricsReporter is not None:
+            self.metricsReporter.close()
+        self.data_source.close()
+        super(HidraLiveViewer, self).closeEvent(event)
+
     # call the connect function of the hidra interface
     def connect_hidra(self):
         if self.data_source is None:
@@ -278,66 +452,83 @@ class HidraLiveViewer(QtGui.QDialog):
         # check if data is there at all
         if name is None:
             return
-        # first time: 
-        if self.image_name is None:
-            self.image_name, self.raw_image = self.exchangelist.readData()
-        # check if data is really new
-        elif str(self.image_name) is not str(name):
-            self.image_name, self.raw_image = self.exchangelist.readData()
-        self.plot()
+        self.dataFetcher.signalReceived()
+        # draw now or when the display interval has passed
+        delay = self.displayScheduler.request()
+        if delay > 0:
+            if not self.displayTimer.isActive():
+                self.displayTimer.start(int(1000 * delay) + 1)
+            return
+        self.showLatest()
 
-    def prepareImage(self):
-        if(self.raw_image is None):
+    def showLatest(self):
+        # the next or the newest frame, None if it has been displayed
+        # already
+        if self.drawAll:
+            record = self.frameRing.readNext()
+        else:
+            record = self.frameRing.readLatest()
+        if record is None:
             return
-        self.display_image = self.raw_image
-        
-        if self.doBkgSubtraction and self.background_image is not None:
-            # simple subtraction
-            self.display_image = self.raw_image - self.background_image
-        #~ if self.applyImageMask and self.maskIndices is not None:
-            #~ # set all masked (non-zero values) to zero by index
-            #~ self.display_image[self.maskIndices] = 0
-            
+        previous = self.raw_image
+        self.image_name, self.raw_image = record.name, record.image
+        self.raw_orientation = record.orientation
+        self.frameCount += 1
+        start = time.time()
+        self.plot()
+        self.displayScheduler.markDrawn()
+        metrics = self.metrics
+        metrics.count("processed")
+        metrics.count("displayed")
+        metrics.latency("wait", start - record.stored)
+        metrics.latency("process", self.plotTiming[0])
+        metrics.latency("draw", self.plotTiming[1])
+        metrics.latency("total", time.time() - record.received)
+        # the previous frame is not displayed any more: reuse its buffer
+        if previous is not None and previous is not self.raw_image:
+            self.data_source.releaseData(previous)
+        # frames signalled while this one was drawn, drawn after the
+        # event loop has painted this one
+        if self.drawAll and self.frameRing.pending():
+            self.displayTimer.start(
+                int(1000 * self.displayScheduler.request()) + 1)
+
+    def processImage(self):
+        '''Runs the preprocessing pipeline on the raw image into the
+           display image and returns max, mean, variance and min.'''
+        if self.raw_image is None:
+            return 0., 0., 0., 0.
+        self.pipeline.setEnabled("correction", self.doCorrection)
+        self.pipeline.setEnabled("background", self.doBkgSubtraction)
+        self.pipeline.setEnabled("mask", self.applyImageMask)
+        frame, orientation = self.raw_image, self.raw_orientation
+        # frames decoded transformed already skip the transform stage;
+        # others, e.g. decoded before the transformation was changed,
+        # are transformed from their untransformed view
+        transform = orientation != TRAFOORIENTATIONS[str(self.trafoName)]
+        if transform:
+            frame, orientation = self.unorientedRaw(), None
+        self.pipeline.setEnabled("transform", transform)
+        self.orientMaps(orientation)
+        self.display_image, info = self.pipeline.run(
+            frame, (self.frameCount, orientation))
+        self.stageTimings = info["timings"]
+        return self.calcStats(info["stats"])
+
     def scale(self, scalingType):
-        if(self.display_image is None):
-            return
-        if scalingType == "sqrt":
-            self.display_image = np.clip(self.display_image, 0, np.inf)
-            self.display_image = np.sqrt(self.display_image)
-        elif scalingType == "log":
-            self.display_image = np.clip(self.display_image, 10e-3, np.inf)
-            self.display_image = np.log10(self.display_image)
-
-    def transform(self):
-        '''Do the image transformation on the given numpy array.'''
-        if self.display_image is None or self.trafoName is "None":
-            return
-        # !!! there is a place, where indices go to die...
-        # somewhere, the ordering of the indices gets messed up
-        # to rectify the situation and not mislead users, 
-        # make the transformation, so that at least the name fits
-        elif self.trafoName == "flipud":
-            self.display_image = np.fliplr(self.display_image)
-        elif self.trafoName == "rotate90":
-            self.display_image = np.rot90(self.display_image)
-        elif self.trafoName == "mirror":
-            self.display_image = np.flipud(self.display_image)
-    
-    def calcStats(self):
-        if self.display_image is not None:
-            maxval = np.amax(self.display_image)
-            meanval = np.mean(self.display_image)
-            varval = np.var(self.display_image)
-            # automatic maximum clipping to hardcoded value
-            checkval = meanval + 10*np.sqrt(varval)
-            if (maxval > checkval):
-                maxval = checkval
-            return (str("%.4f" % maxval),
-                    str("%.4f" % meanval),
-                    str("%.4f" % varval),
-                    str("%.3f" % np.amin(self.display_image)))
-        else:
-            return "0.", "0.", "0.", "0."
+        self.pipeline.get("scaling").scaling = str(scalingType)
+
+    def calcStats(self, stats):
+        if not stats["pixels"]:
+            return 0., 0., 0., 0.
+        maxval = stats["max"]
+        meanval = stats["mean"]
+        varval = stats["var"]
+        # automatic maximum clipping to hardcoded value
+        checkval = meanval + 10*np.sqrt(varval)
+        if (maxval > checkval):
+            maxval = checkval
+        return maxval, meanval, varval, stats["min"]
 
     def getInitialLevels(self):
         if(self.display_image is not None):
@@ -359,14 +550,123 @@ class HidraLiveViewer(QtGui.QDialog):
             self.bkgSubW.setDisplayedName("")
 
     def prepareBKGSubtraction(self, imagename):
-        self.background_image = imageFileHandler.ImageFileHandler(str(imagename)).getImage()
+        self.background_unoriented = imageFileHandler.ImageFileHandler(str(imagename)).getImage()
+        self.orientBKG()
 
     def setCurrentImageAsBKG(self):
         if self.raw_image is not None:
-            self.background_image = self.raw_image
+            # the raw image buffer is reused by the data source
+            self.background_unoriented = self.unorientedRaw().copy()
+            self.orientBKG()
             self.bkgSubW.setDisplayedName(str(self.image_name))
         else:
             self.bkgSubW.setDisplayedName("")
 
+    def checkCorrection(self, state):
+        self.doCorrection = bool(state)
+
+    def startDark(self, frames):
+        '''Averages the next decoded frames into the dark image, whether
+           they are displayed or not.'''
+        with self.darkLock:
+            self.darkAccumulator = frameStatistics.RunningMean(frames)
+        self.dataFetcher.removeObserver(self.accumulateDark)
+        self.dataFetcher.addObserver(self.accumulateDark)
+        self.darkFlatW.setDarkName("taking %d frames" % frames)
+
+    def accumulateDark(self, name, image, orientation):
+        # called by the decoding threads; averaged untransformed, the
+        # frames may be decoded transformed
+        with self.darkLock:
+            accumulator = self.darkAccumulator
+            if accumulator is None or accumulator.done():
+                return
+            if accumulator.update(frameDecoders.orientView(
+                    image, orientation, inverse=True)):
+                self.darkTaken.emit()
+
+    def finishDark(self):
+        self.dataFetcher.removeObserver(self.accumulateDark)
+        with self.darkLock:
+            accumulator, self.darkAccumulator = self.darkAccumulator, None
+        if accumulator is None:
+            return
+        self.dark_unoriented = accumulator.mean()
+        self.darkFlatW.setDarkName("mean of %d frames" % accumulator.count)
+        self.orientCorrection()
+
+    def loadCorrectionImage(self, fname):
+        '''.npy files are mapped, not read.'''
+        if fname.endswith(".npy"):
+            return np.load(fname, mmap_mode="r")
+        return imageFileHandler.ImageFileHandler(fname).getImage()
+
+    def loadDark(self, fname):
+        self.dark_unoriented = self.loadCorrectionImage(str(fname))
+        self.darkFlatW.setDarkName(
+            "" if self.dark_unoriented is None else str(fname))
+        self.orientCorrection()
+
+    def saveDark(self, fname):
+        if self.dark_unoriented is not None:
+            np.save(str(fname), self.dark_unoriented)
+
+    def loadFlat(self, fname):
+        self.gain_unoriented = self.loadCorrectionImage(str(fname))
+        self.darkFlatW.setFlatName(
+            "" if self.gain_unoriented is None else str(fname))
+        self.orientCorrection()
+
+    def orientCorrection(self):
+        stage = self.pipeline.get("correction")
+        stage.setDark(None if self.dark_unoriented is None else
+                      frameDecoders.orientView(
+                          self.dark_unoriented, self.mapsOrientation))
+        stage.setGain(None if self.gain_unoriented is None else
+                      frameDecoders.orientView(
+                          self.gain_unoriented, self.mapsOrientation))
+
+    def saveCurrentImage(self):
+        '''Write the current raw image as byte offset compressed cbf.'''
+        if self.raw_image is None:
+            return
+        if self.raw_image.dtype.kind not in "iu":
+            print("<WARNING> Only integer images can be saved as CBF.")
+            return
+        fname = str(QtGui.QFileDialog.getSaveFileName(
+            self, 'Save image', '.', 'CBF files (*.cbf)'))
+        if fname:
+            cbfCodec.writeCbf(fname, self.unorientedRaw())
+
+    def unorientedRaw(self):
+        '''The raw image as decoded without any transformation (a view).'''
+        return frameDecoders.orientView(
+            self.raw_image, self.raw_orientation, inverse=True)
+
+    def decodeOrientation(self):
+        '''Orientation new frames are delivered in by the data source.'''
+        if self.orientOnDecode:
+            return TRAFOORIENTATIONS[str(self.trafoName)]
+        return None
+
+    def orientMaps(self, orientation):
+        '''Background, dark and gain in the orientation of the frame.'''
+        if orientation != self.mapsOrientation:
+            self.mapsOrientation = orientation
+            self.orientBKG()
+            self.orientCorrection()
+
+    def orientBKG(self):
+        if self.background_unoriented is None:
+            self.background_image = None
+        else:
+            self.background_image = frameDecoders.orientView(
+                self.background_unoriented, self.mapsOrientation)
+        self.pipeline.get("background").setBackground(self.background_image)
+
     def assessTransformation(self, trafoName):
         self.trafoName = trafoName
+        self.pipeline.get("transform").trafoName = trafoName
+        # new frames are decoded in the transformed layout, no copies later
+        if self.orientOnDecode:
+            self.data_source.setOutput(self.decodeOrientation())
@@ -20,6 +20,8 @@
 # Boston, MA  02110-1301, USA.
 
 
+import socket
+
 from PyQt4 import QtCore, QtGui
 
 
@@ -89,6 +91,15 @@ class HidraWidget(QtGui.QGroupBox):
         self.sortServerList(name)
         self.serverlistBox.addItems(self.sortedserverlist)
 
+    def setSingleSource(self, kind, name):
+        '''Offer only the given source, e.g. a watched directory.'''
+        self.setTitle("%s connection" % kind.capitalize())
+        self.serverLabel.setText(u"Source")
+        self.currenthost.setText(socket.getfqdn())
+        self.serverlistBox.clear()
+        self.serverlistBox.addItem(str(name))
+        self.button.setEnabled(True)
+
     def isConnected(self):
         return self.connected
 
@@ -27,15 +27,129 @@ except ImportError:
 import socket
 import numpy as np
 
-class HiDRA_cbf_source():
+from . import dataSource
 
-    def __init__(self, timeout=None):
+
+# initiated transfers kept for switching between servers
+TRANSFERPOOLSIZE = 4
+# stale frames read at most when a transfer is activated again
+FLUSHLIMIT = 100
+
+
+class HidraTransfer(object):
+    '''A hidra transfer to one signal host and its health state:
+       "new" (created), "active" (initiated and started, frames are
+       fetched), "idle" (started, but not read from) or "failed".'''
+
+    def __init__(self, signalhost, port):
+        self.signal_host = signalhost
+        self.port = port
+        self.state = "new"
+        self.error = None
+        self.query = hidra.Transfer("QUERY_NEXT", signalhost)
+
+    def activate(self, target):
+        '''Initiate and start the transfer if not done yet, otherwise
+           throw away the frames waiting since it was last used.
+           Returns True if the transfer is ready.'''
+        try:
+            if self.state == "new":
+                self.query.initiate(target)
+                self.query.start()
+            elif self.state == "idle":
+                self.flush()
+            elif self.state == "failed":
+                return False
+        except Exception as error:
+            self.fail(error)
+            return False
+        self.state = "active"
+        return True
+
+    def flush(self):
+        '''Read and drop the frames which are already waiting.'''
+        flushed = 0
+        while flushed < FLUSHLIMIT:
+            metadata, data = self.query.get(0)
+            if metadata is None or data is None:
+                break
+            flushed += 1
+        return flushed
+
+    def deactivate(self):
+        if self.state == "active":
+            self.state = "idle"
+
+    def fail(self, error):
+        self.state = "failed"
+        self.error = error
+        self.stop()
+
+    def stop(self):
+        try:
+            self.query.stop()
+        except Exception:
+            pass
+
+
+class TransferPool(object):
+    '''The transfers to the last size signal hosts used, the least
+       recently used one is stopped when another one is needed. Every
+       transfer gets its own data port, counting up from the base port.'''
+
+    def __init__(self, size=TRANSFERPOOLSIZE, port=50001):
+        self.size = size
+        self.port = int(port)
+        # most recently used last
+        self._transfers = []
+
+    def get(self, signalhost):
+        '''The transfer to signalhost, a new one if there is none or it
+           failed.'''
+        transfer = self.find(signalhost)
+        if transfer is not None:
+            self._transfers.remove(transfer)
+            if transfer.state == "failed":
+                transfer = None
+        if transfer is None:
+            while len(self._transfers) >= self.size:
+                self._transfers.pop(0).stop()
+            used = set(trf.port for trf in self._transfers)
+            port = self.port
+            while port in used:
+                port += 1
+            transfer = HidraTransfer(signalhost, port)
+        self._transfers.append(transfer)
+        return transfer
+
+    def find(self, signalhost):
+        for transfer in self._transfers:
+            if transfer.signal_host == signalhost:
+                return transfer
+
+    def states(self):
+        '''(signal host, port, state) of the kept transfers.'''
+        return [(trf.signal_host, trf.port, trf.state)
+                for trf in self._transfers]
+
+    def stopAll(self):
+        for transfer in self._transfers:
+            transfer.stop()
+        self._transfers = []
+
+
+class HiDRA_cbf_source(dataSource.DataSource):
+
+    def __init__(self, timeout=None, keepFrames=0, port="50001"):
+        super(HiDRA_cbf_source, self).__init__(timeout, keepFrames)
         self.signal_host = None
-        self.portnumber = "50001"
-        self.target = [socket.getfqdn(), self.portnumber, 19, [".cbf"]]
+        self.portnumber = str(port)
         self.query = None
+        self.transfer = None
+        self.transfers = TransferPool(port=self.portnumber)
         self._initiated = False
-        self._timeout = timeout
+        self.target = [socket.getfqdn(), self.portnumber, 19,
+                       self.decoders.suffixes()]
 
     def getTargetSignalHost(self):
         return self.target[0]+":"+self.portnumber, self.signal_host
@@ -49,201 +163,74 @@ class HiDRA_cbf_source():
         
     def setSignalHost(self, signalhost):
         if self.signal_host != signalhost:
+            if self.transfer is not None:
+                self.transfer.deactivate()
             self.signal_host = signalhost
-            self.query = hidra.Transfer("QUERY_NEXT", self.signal_host)
-            self._initiated = False
+            # an earlier transfer to this host is reused, still initiated
+            self.transfer = self.transfers.get(signalhost)
+            self.query = self.transfer.query
+            self._initiated = self.transfer.state != "new"
+            self.portnumber = str(self.transfer.port)
+            self.target[1] = self.portnumber
 
     def setTargetPort(self, portnumber):
         self.portnumber = portnumber
 
     def connect(self):
-        try:
-            if(not self._initiated):
-                self.query.initiate(self.target)
-                self._initiated = True
-                self.query.start()
-            return True
-        except:
-            if self.query is not None:
-                self.query.stop()
+        if self.transfer is None:
             return False
+        if self.transfer.state == "failed":
+            # start over with a fresh transfer
+            self.transfer = self.transfers.get(self.signal_host)
+            self.query = self.transfer.query
+        self._initiated = self.transfer.activate(self.target)
+        return self._initiated
 
     def disconnect(self):
-        try:
-            pass #self.query.stop()
-        except:
-            pass
+        # the transfer stays initiated for a quick reconnect
+        if self.transfer is not None:
+            self.transfer.deactivate()
+
+    def close(self):
+        self.transfers.stopAll()
+        self.transfer = None
+        self.query = None
+        self._initiated = False
+
+    def status(self):
+        if self.transfer is None:
+            return "no server"
+        if self.transfer.state == "failed":
+            return "failed: %s" % self.transfer.error
+        return self.transfer.state
+
+    def stream(self):
+        return self.signal_host
 
-    def getData(self):
+    def receive(self):
+        '''Fetch the next payload and its metadata without decoding it.'''
         metadata = None
         data = None
+        if self.transfer is None or self.transfer.state != "active":
+            return None, None
         try:
             [metadata, data] = self.query.get(self._timeout)
-        except:
-            pass  # this needs a bit more care
+        except Exception as error:
+            self.transfer.fail(error)
 
         if metadata is not None and data is not None:
-            print ("[cbf source module]::metadata", metadata["filename"])
-            #~ print ("data", str(data)[:10])
-
-            if (data[:10] == "###CBF: VE"):
-                img = self.eval_pildata(np.fromstring(data[:], dtype=np.uint8))
-                return np.transpose(img), metadata["filename"]
-        else:
-            return None, None
+            return data, metadata
+        return None, None
 
     def decompress_cbf_c(self, stream, vals):
-        xdim = long(487)
-        ydim = 619
-        padding = long(4095)
-        n_out = xdim * ydim
-
-        if (vals.size == 4 and sum(vals) != 0):  # simply assume content fits here
-            xdim = vals[1]
-            ydim = vals[2]
-            padding = vals[3]
-            n_out = vals[0]
-
-        tmp = np.zeros(stream.size, dtype='int32') + stream
-        mymap = np.zeros(stream.size, dtype='uint8') + 1
-        isvalid = np.zeros(stream.size, dtype='uint8') + 1
-
-        id_relevant = np.where(stream == 128)
-
-        # overcome issue if 128 exists in padding (seems so that
-        # either this does not happened before or padding was 0 in any case)
-        try:
-            idd = np.where(id_relevant < (tmp.size - padding))
-            id_relevant = id_relevant[idd]
-        except:
-            pass
-
-        for dummy, dummy2 in enumerate(id_relevant):
-            for j, i in enumerate(dummy2):
-                if (mymap[i] != 0):
-                    if(stream[i + 1] != 0 or stream[i + 2] != 128):
-                        mymap[i:i + 3] = 0
-                        isvalid[i + 1:i + 3] = 0
-                        delta = tmp[i + 1] + tmp[i + 2] * 256
-                        if (delta > 32768):
-                            delta -= 65536
-                        tmp[i] = delta
-                    else:
-                        mymap[i:i + 7] = 0
-                        isvalid[i + 1:i + 7] = 0
-    #					delta=sum(np.multiply(tmp[i+3:i+7],np.array([1,256,65536,16777216],dtype='int64')))
-                        delta = (
-                            np.multiply(tmp[i + 3:i + 7], np.array([1, 256, 65536, 16777216], dtype='int64'))).sum()
-                        if (delta > 2147483648):
-                            delta -= 4294967296
-                        tmp[i] = delta
-
-        try:
-            id8sign = np.where((stream > 128) & (mymap != 0))
-            tmp[id8sign] -= 256
-            # print ("adjusting 8Bit vals")
-            # for i, j in enumerate(stream):
-            #	if ( j > 128 and mymap[i] !=0):
-            #		tmp[i]=tmp[i]-256
-            # print stream[0:11]
-            # print tmp[0:11]
-
-        except:
-            print ("error debug1")
-            pass
-
-        try:
-            # print sum(isvalid)	#should be 305548
-            id = np.where(isvalid != 0)
-            tmp = tmp[id]
-        except:
-            pass
-
-        # print stream[0:11]
-        # print tmp[0:11]
-
-        res = np.cumsum(tmp, dtype='int32')
-        # print max(res)
-
-        if ((res.size - padding) != n_out):
+        return self.decoders.get("cbf-byte-offset").decompress(stream, vals).T
+
+    def eval_pildata(self, data):
+        decoder = self.decoders.get("cbf-byte-offset")
+        header = decoder.probe(data, None)
+        image = None
+        if header is not None:
+            image = decoder.decode(data, header)
+        if image is None:
             return np.array([0])
-        # by A.R., Apr 24, 2017
-        # return res[0:n_out].reshape(xdim, ydim)
-        return res[0:n_out].reshape(xdim, ydim, order='F')
-
-    def eval_pildata(self, tmp):
-        image = np.array([0])
-        inpoint = np.array([26, 4, 213], dtype='uint8')
-        outpoint = np.array(
-            [45, 45, 67, 73, 70, 45, 66, 73, 78, 65, 82, 89, 45, 70,
-             79, 82, 77, 65, 84, 45, 83, 69, 67, 84, 73, 79, 78, 45, 45, 45], dtype='uint8')
-        flag = 0
-
-        # check if byte offset compress
-        boc = np.array(
-            [120, 45, 67, 66, 70, 95, 66, 89, 84, 69, 95, 79, 70, 70, 83, 69, 84], dtype='uint8')
-
-        try:
-            iscbf = tmp.tostring().index(boc.tostring()) // tmp.itemsize
-        except:
-            flag = 1
-
-        # additional parms for cross check if decompress worked out
-        dset_num_ele = np.array(
-            [88, 45, 66, 105, 110, 97, 114, 121, 45, 78, 117, 109, 98,
-             101, 114, 45, 111, 102, 45, 69, 108, 101, 109, 101, 110, 116, 115, 58], dtype='uint8')
-        dset_fast_dim = np.array(
-            [88, 45, 66, 105, 110, 97, 114, 121, 45, 83, 105, 122, 101, 45, 70, 97,
-             115, 116, 101, 115, 116, 45, 68, 105, 109, 101, 110, 115, 105, 111, 110, 58], dtype='uint8')
-        dset_sec_dim = np.array(
-            [88, 45, 66, 105, 110, 97, 114, 121, 45, 83, 105, 122, 101, 45, 83,
-             101, 99, 111, 110, 100, 45, 68, 105, 109, 101, 110, 115, 105, 111, 110, 58], dtype='uint8')
-        dset_pad = np.array(
-            [88, 45, 66, 105, 110, 97, 114, 121, 45, 83, 105, 122, 101, 45, 80, 97, 100, 100, 105, 110, 103, 58], dtype='uint8')
-
-        # search for data stream start
-        if (flag == 0):
-            try:
-                idstart = tmp.tostring().index(
-                    inpoint.tostring()) // tmp.itemsize
-                idstart += inpoint.size
-            except:
-                flag = 1
-
-            try:
-                idstop = tmp.tostring().index(
-                    outpoint.tostring()) // tmp.itemsize
-                idstop -= 3  # cr / extra -1 due to '10B' -- linefeed
-            except:
-                flag = 1
-
-            vals = np.zeros(4, dtype='int')
-            spos = np.zeros(5, dtype='int')
-            spos[4] = idstart
-            try:
-                spos[0] = tmp.tostring().index(
-                    dset_num_ele.tostring()) // tmp.itemsize
-                spos[1] = tmp.tostring().index(
-                    dset_fast_dim.tostring()) // tmp.itemsize
-                spos[2] = tmp.tostring().index(
-                    dset_sec_dim.tostring()) // tmp.itemsize
-                spos[3] = tmp.tostring().index(
-                    dset_pad.tostring()) // tmp.itemsize
-# by A.R., Apr 24, 2017
-                vals[0] = int(
-                    tmp[spos[0] + dset_num_ele.size:spos[1] - 2].tostring())
-                vals[1] = int(
-                    tmp[spos[1] + dset_fast_dim.size:spos[2] - 2].tostring())
-                vals[2] = int(
-                    tmp[spos[2] + dset_sec_dim.size:spos[3] - 2].tostring())
-                vals[3] = int(
-                    tmp[spos[3] + dset_pad.size:spos[4] - 8].tostring())
-            except:
-                flag = 1
-
-            if (flag == 0):
-                image = 0
-                image = self.decompress_cbf_c(tmp[idstart:idstop + 1], vals)
-            else:
-                image = np.array([0])
-        return image
+        return image.T
@@ -0,0 +1,333 @@
+# Copyright (C) 2017  Christoph Rosemann, DESY, Notkestr. 85, D-22607 Hamburg
+# email contact: christoph.rosemann@desy.de
+#
+# lavue is an image viewing program for photon science imaging detectors.
+# Its usual application is as a live viewer using hidra as data source.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation in  version 2
+# of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+
+# the preprocessing of a frame before it is displayed
+
+import time
+import numpy as np
+
+from . import bufferPool
+from . import frameStatistics
+from . import scalingEngine
+
+# the stages of a default pipeline in processing order
+STAGES = ("correction", "background", "mask", "transform", "scaling",
+          "stats")
+
+# pixels corrected at once, subtraction and gain share the cache
+CORRECTIONPIXELS = 1 << 15
+
+# lavue names of the transformations; flipud really is a left-right flip
+TRANSFORMATIONS = {"flipud": np.fliplr,
+                   "rotate90": np.rot90,
+                   "mirror": np.flipud}
+
+
+class Stage(object):
+    '''One step of an ImagePipeline.
+
+       A stage that writes (writes = True) gets a float32 output array of
+       the image shape: the image itself when the pipeline owns it
+       already, otherwise a scratch buffer of the stage. Other stages
+       return the image or a view of it.
+       parameters identifies everything the output depends on besides
+       the input image.'''
+
+    name = None
+    writes = False
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+
+    def active(self, image):
+        '''Whether the stage changes the given image at all.'''
+        return self.enabled
+
+    def parameters(self):
+        return ()
+
+    def apply(self, image, out, info):
+        return image
+
+
+class CorrectionStage(Stage):
+    '''Dark and flat-field correction (raw - dark) * gain, row chunk by
+       row chunk so that the frame is only passed once. Dark and gain
+       maps are float32, a map of another shape than the frame is not
+       applied.'''
+
+    name = "correction"
+    writes = True
+
+    def __init__(self, dark=None, gain=None, enabled=True):
+        Stage.__init__(self, enabled)
+        self.version = 0
+        self.dark = self._map(dark)
+        self.gain = self._map(gain)
+
+    def _map(self, image):
+        self.version += 1
+        if image is None:
+            return None
+        # float32 .npy memmaps are used as they are
+        return np.asarray(image, dtype=np.float32)
+
+    def setDark(self, dark):
+        self.dark = self._map(dark)
+
+    def setGain(self, gain):
+        self.gain = self._map(gain)
+
+    def _maps(self, image):
+        return [cmap for cmap in (self.dark, self.gain)
+                if cmap is not None and cmap.shape == image.shape]
+
+    def active(self, image):
+        return self.enabled and bool(self._maps(image))
+
+    def parameters(self):
+        return (self.version,)
+
+    def apply(self, image, out, info):
+        dark, gain = [cmap if cmap is not None and
+                      cmap.shape == image.shape else None
+                      for cmap in (self.dark, self.gain)]
+        step = max(1, CORRECTIONPIXELS // max(1, image[0].size))
+        for top in range(0, image.shape[0], step):
+            rows = slice(top, top + step)
+            if dark is not None:
+                np.subtract(image[rows], dark[rows], out=out[rows])
+            elif out is not image:
+                np.copyto(out[rows], image[rows])
+            if gain is not None:
+                np.multiply(out[rows], gain[rows], out=out[rows])
+        return out
+
+
+class BackgroundStage(Stage):
+    '''Subtracts a background image of the same shape.'''
+
+    name = "background"
+    writes = True
+
+    def __init__(self, background=None, enabled=True):
+        Stage.__init__(self, enabled)
+        self.setBackground(background)
+
+    def setBackground(self, background):
+        # the arrays are compared by version, not by content
+        self.version = getattr(self, "version", 0) + 1
+        self.background = None
+        if background is not None:
+            self.background = np.asarray(background, dtype=np.float32)
+
+    def active(self, image):
+        return self.enabled and self.background is not None and \
+            self.background.shape == image.shape
+
+    def parameters(self):
+        return (self.version,)
+
+    def apply(self, image, out, info):
+        return np.subtract(image, self.background, out=out)
+
+
+class MaskStage(Stage):
+    '''Sets the masked (non-zero) pixels to zero.'''
+
+    name = "mask"
+    writes = True
+
+    def __init__(self, mask=None, enabled=True):
+        Stage.__init__(self, enabled)
+        self.setMask(mask)
+
+    def setMask(self, mask):
+        self.version = getattr(self, "version", 0) + 1
+        self.mask = None
+        if mask is not None:
+            self.mask = np.asarray(mask) != 0
+
+    def active(self, image):
+        return self.enabled and self.mask is not None and \
+            self.mask.shape == image.shape
+
+    def parameters(self):
+        return (self.version,)
+
+    def apply(self, image, out, info):
+        if out is not image:
+            np.copyto(out, image)
+        np.copyto(out, 0, where=self.mask)
+        return out
+
+
+class TransformStage(Stage):
+    '''Flips or rotates the image as a view, nothing is copied.'''
+
+    name = "transform"
+
+    def __init__(self, trafoName="None", enabled=True):
+        Stage.__init__(self, enabled)
+        self.trafoName = trafoName
+
+    def active(self, image):
+        return self.enabled and str(self.trafoName) in TRANSFORMATIONS
+
+    def parameters(self):
+        return (str(self.trafoName),)
+
+    def apply(self, image, out, info):
+        return TRANSFORMATIONS[str(self.trafoName)](image)
+
+
+class ScalingStage(Stage):
+    '''Square root or logarithmic intensity scaling, by lookup tables
+       for integer images.'''
+
+    name = "scaling"
+    writes = True
+
+    def __init__(self, scaling="linear", enabled=True, method="auto"):
+        Stage.__init__(self, enabled)
+        self.scaling = scaling
+        self.engine = scalingEngine.ScalingEngine(method)
+
+    def active(self, image):
+        return self.enabled and self.scaling in ("sqrt", "log")
+
+    def parameters(self):
+        return (self.scaling,)
+
+    def apply(self, image, out, info):
+        return self.engine.scale(image, self.scaling, out)
+
+
+class StatsStage(Stage):
+    '''Minimum, maximum, mean, variance and sum of the image, stored in
+       info["stats"]. Masked (non-zero) pixels of mask are left out.
+       Frames larger than maxPixels are subsampled with a stride.'''
+
+    name = "stats"
+
+    def __init__(self, mask=None, enabled=True, maxPixels=None):
+        Stage.__init__(self, enabled)
+        self.mask = None
+        if mask is not None:
+            self.mask = np.asarray(mask) != 0
+        self.maxPixels = maxPixels
+
+    def parameters(self):
+        return (id(self.mask), self.maxPixels)
+
+    def apply(self, image, out, info):
+        info["stats"] = frameStatistics.frameStats(
+            image, self.mask,
+            frameStatistics.subsampleStep(image.shape, self.maxPixels))
+        return image
+
+
+class ImagePipeline(object):
+    '''Runs the enabled stages in order over a frame.
+
+       The input frame is never modified. Writing stages work in place on
+       preallocated float32 buffers, which are reused for the next frame:
+       the output is only valid until the next run in the same thread.
+       run returns the output and an info dict with the seconds spent
+       per recomputed stage ("timings") and whatever the stages add to it.
+
+       With cache = True every writing stage keeps its own buffer and the
+       output of each stage is remembered together with the frame key
+       given to run and the parameters of all stages up to it. Running
+       the same frame again only recomputes the stages from the first
+       one whose parameters changed; the pipeline must then be run from
+       one thread only.'''
+
+    def __init__(self, stages=None, pool=None, cache=False):
+        if stages is None:
+            stages = [CorrectionStage(), BackgroundStage(), MaskStage(),
+                      TransformStage(), ScalingStage(), StatsStage()]
+        self.stages = list(stages)
+        self.pool = pool or bufferPool.BufferPool()
+        self.cache = cache
+        # per stage: key, output, whether the pipeline owns it, info
+        self._cached = {}
+
+    def names(self):
+        return [stage.name for stage in self.stages]
+
+    def get(self, name):
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+        raise KeyError("No pipeline stage: %s" % name)
+
+    def setEnabled(self, name, enabled=True):
+        self.get(name).enabled = enabled
+
+    def reorder(self, names):
+        '''Sets the processing order, names are all the stage names.'''
+        names = list(names)
+        if sorted(names) != sorted(self.names()):
+            raise ValueError("Not an order of the stages %s: %s" % (
+                ", ".join(self.names()), ", ".join(names)))
+        self.stages = [self.get(name) for name in names]
+
+    def invalidate(self):
+        '''Forgets all cached stage outputs.'''
+        self._cached = {}
+
+    def run(self, image, key=None):
+        '''Processes image, key identifies its content for the cache.'''
+        info = {"timings": {}}
+        owned = False
+        caching = self.cache and key is not None
+        if not caching:
+            self._cached = {}
+        for stage in self.stages:
+            active = stage.active(image)
+            if caching:
+                key = (key, stage.name, active, stage.parameters())
+                cached = self._cached.get(stage.name)
+                if cached is not None and cached[0] == key:
+                    image, owned = cached[1], cached[2]
+                    info.update(cached[3])
+                    continue
+            start = time.time()
+            if active:
+                out = None
+                if stage.writes:
+                    if owned and image.dtype == np.float32 and \
+                            not caching:
+                        out = image
+                    else:
+                        # cached outputs of earlier stages stay intact
+                        out = self.pool.getScratch(
+                            "pipeline-" + stage.name, image.size,
+                            np.float32).reshape(image.shape)
+                        owned = True
+                image = stage.apply(image, out, info)
+            info["timings"][stage.name] = time.time() - start
+            if caching:
+                self._cached[stage.name] = (key, image, owned, dict(
+                    (name, value) for name, value in info.items()
+                    if name != "timings"))
+        return image, info
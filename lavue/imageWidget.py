@@ -32,6 +32,8 @@ class ImageWidget(QtGui.QWidget):
     The part of the GUI that incorporates the image view.
     """
 
+    saveImage = QtCore.pyqtSignal()
+
     def __init__(self, parent=None):
         super(ImageWidget, self).__init__(parent)
 
@@ -48,6 +50,9 @@ class ImageWidget(QtGui.QWidget):
         filenamelayout.addWidget(filelabel)
         self.filenamedisplay = QtGui.QLineEdit()
         filenamelayout.addWidget(self.filenamedisplay)
+        self.saveButton = QtGui.QPushButton("Save as CBF")
+        self.saveButton.clicked.connect(self.saveImage.emit)
+        filenamelayout.addWidget(self.saveButton)
 
         verticallayout.addLayout(filenamelayout)
         verticallayout.addWidget(self.img_widget)
@@ -0,0 +1,75 @@
+# Copyright (C) 2017  Christoph Rosemann, DESY, Notkestr. 85, D-22607 Hamburg
+# email contact: christoph.rosemann@desy.de
+#
+# lavue is an image viewing program for photon science imaging detectors.
+# Its usual application is as a live viewer using hidra as data source.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation in  version 2
+# of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+
+
+from PyQt4 import QtGui
+
+from . import pipelineMetrics
+
+
+class MetricsWidget(QtGui.QGroupBox):
+
+    """
+    Display the frame counters and latencies of the data pipeline.
+    """
+
+    def __init__(self, parent=None):
+        super(MetricsWidget, self).__init__(parent)
+
+        self.setTitle("Pipeline")
+        layout = QtGui.QGridLayout()
+
+        layout.addWidget(QtGui.QLabel("frames"), 0, 1)
+        layout.addWidget(QtGui.QLabel("per s"), 0, 2)
+        self.counters = {}
+        row = 1
+        for name in pipelineMetrics.COUNTERS:
+            total = QtGui.QLabel("0")
+            rate = QtGui.QLabel("0")
+            layout.addWidget(QtGui.QLabel(name + ": "), row, 0)
+            layout.addWidget(total, row, 1)
+            layout.addWidget(rate, row, 2)
+            self.counters[name] = (total, rate)
+            row += 1
+
+        layout.addWidget(QtGui.QLabel("ms p50"), row, 1)
+        layout.addWidget(QtGui.QLabel("ms p95"), row, 2)
+        row += 1
+        self.latencies = {}
+        for name in pipelineMetrics.LATENCIES:
+            median = QtGui.QLabel("-")
+            high = QtGui.QLabel("-")
+            layout.addWidget(QtGui.QLabel(name + ": "), row, 0)
+            layout.addWidget(median, row, 1)
+            layout.addWidget(high, row, 2)
+            self.latencies[name] = (median, high)
+            row += 1
+
+        self.setLayout(layout)
+
+    def update_metrics(self, snap):
+        for name, (total, rate) in self.counters.items():
+            total.setText(str(snap[name]))
+            rate.setText("%.1f" % snap[name + "_rate"])
+        for name, labels in self.latencies.items():
+            for label, pct in zip(labels, (50, 95)):
+                value = snap["%s_p%d_ms" % (name, pct)]
+                label.setText("-" if value is None else "%.1f" % value)
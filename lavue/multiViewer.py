@@ -0,0 +1,118 @@
+# Copyright (C) 2017  Christoph Rosemann, DESY, Notkestr. 85, D-22607 Hamburg
+# email contact: christoph.rosemann@desy.de
+#
+# lavue is an image viewing program for photon science imaging detectors.
+# Its usual application is as a live viewer using hidra as data source.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation in  version 2
+# of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+
+
+# several detectors in one viewer
+
+import math
+import os
+
+from PyQt4 import QtCore, QtGui
+
+from . import decodePool
+from . import hidraLiveViewer
+
+# data ports of the hidra transfers of one pane, see TransferPool
+HIDRAPORTSTRIDE = 10
+
+
+def paneFile(name, index):
+    '''The file of pane index (from 1) for name, e.g. metrics.2.json.'''
+    root, ext = os.path.splitext(name)
+    return "%s.%d%s" % (root, index, ext)
+
+
+class MultiDetectorViewer(QtGui.QDialog):
+    '''Shows several detectors at once, each in a HidraLiveViewer pane
+       with its own data source and receiving thread, in tabs or a grid.
+       The frames of all detectors are decoded by one WorkerGroup, so the
+       decoding threads are shared instead of multiplied.
+
+       sourceOptions is one dict for all panes or a list with one per
+       pane; hidra panes get data ports HIDRAPORTSTRIDE apart. Each pane
+       writes its metrics to its own file, see paneFile; stdout is not
+       possible.'''
+
+    def __init__(self, parent=None, detectors=2, layout="tabs",
+                 decodeWorkers=hidraLiveViewer.DECODEWORKERS,
+                 deliveryPolicy=hidraLiveViewer.DELIVERYPOLICY,
+                 cbfBackend=hidraLiveViewer.CBFBACKEND,
+                 source=hidraLiveViewer.SOURCE, sourceOptions=None,
+                 displayRate=hidraLiveViewer.DISPLAYRATE,
+                 metricsFile=None, metricsFormat="json",
+                 keepFrames=hidraLiveViewer.KEEPFRAMES):
+        super(MultiDetectorViewer, self).__init__(parent)
+        if metricsFile == "-":
+            raise ValueError("The metrics of several detectors cannot be "
+                             "written to stdout")
+
+        self.setAttribute(QtCore.Qt.WA_DeleteOnClose)
+
+        # measured once, the panes only use the result
+        backend = hidraLiveViewer.selectCbfBackend(cbfBackend)
+        self.decodeGroup = decodePool.WorkerGroup(decodeWorkers)
+        self.decodeGroup.start()
+
+        if not isinstance(sourceOptions, (list, tuple)):
+            sourceOptions = [sourceOptions]
+        self.panes = []
+        for index in range(detectors):
+            options = dict(sourceOptions[index % len(sourceOptions)] or {})
+            kind, inner = source, options
+            if source == "shared":
+                # the source of the acquisition process
+                kind = options.get("source", hidraLiveViewer.SOURCE)
+                inner = options["sourceOptions"] = dict(
+                    options.get("sourceOptions") or {})
+            if kind == "hidra":
+                inner.setdefault("port", 50001 + index * HIDRAPORTSTRIDE)
+            self.panes.append(hidraLiveViewer.HidraLiveViewer(
+                parent=self, decodeWorkers=decodeWorkers,
+                deliveryPolicy=deliveryPolicy, cbfBackend=backend,
+                source=source, sourceOptions=options,
+                displayRate=displayRate, decodeGroup=self.decodeGroup,
+                embedded=True, keepFrames=keepFrames,
+                metricsFile=(None if metricsFile is None
+                             else paneFile(metricsFile, index + 1)),
+                metricsFormat=metricsFormat))
+
+        globallayout = QtGui.QVBoxLayout()
+        if layout == "tabs":
+            tabs = QtGui.QTabWidget()
+            for index, pane in enumerate(self.panes):
+                tabs.addTab(pane, "Detector %d" % (index + 1))
+            globallayout.addWidget(tabs)
+        else:
+            grid = QtGui.QGridLayout()
+            columns = int(math.ceil(math.sqrt(detectors)))
+            for index, pane in enumerate(self.panes):
+                grid.addWidget(pane, index // columns, index % columns)
+            globallayout.addLayout(grid)
+        self.setLayout(globallayout)
+        self.setWindowTitle("laVue: Live Image Viewer, %d detectors"
+                            % detectors)
+
+    def closeEvent(self, event):
+        # the panes stop their threads before the shared decoders
+        for pane in self.panes:
+            pane.close()
+        self.decodeGroup.stop()
+        super(MultiDetectorViewer, self).closeEvent(event)
@@ -0,0 +1,185 @@
+# Copyright (C) 2017  Christoph Rosemann, DESY, Notkestr. 85, D-22607 Hamburg
+# email contact: christoph.rosemann@desy.de
+#
+# lavue is an image viewing program for photon science imaging detectors.
+# Its usual application is as a live viewer using hidra as data source.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation in  version 2
+# of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+
+# frame counters and latency histograms of the receive-decode-display chain
+
+import json
+import threading
+import time
+
+import numpy as np
+
+# counted events, in the order of the pipeline
+COUNTERS = ("received", "decoded", "processed", "displayed", "dropped",
+            "skipped")
+# measured intervals: received to decoded, decoded to the start of the
+# processing, processing, drawing and received to drawn
+LATENCIES = ("decode", "wait", "process", "draw", "total")
+# percentiles reported per latency
+PERCENTILES = (50, 95, 99)
+
+# upper bin edges of the latency histograms in seconds, 100 us to 100 s
+BINEDGES = np.logspace(-4, 2, 61)
+
+
+class LatencyHistogram(object):
+    '''Counts of latencies in logarithmic bins, the last bin collects
+       everything above BINEDGES[-1].'''
+
+    def __init__(self, edges=BINEDGES):
+        self.edges = edges
+        self.counts = np.zeros(len(edges) + 1, dtype=np.int64)
+        self.total = 0.
+
+    def add(self, seconds):
+        self.counts[np.searchsorted(self.edges, seconds)] += 1
+        self.total += seconds
+
+    def count(self):
+        return int(self.counts.sum())
+
+    def percentile(self, percent, counts=None):
+        '''Upper edge of the bin holding the given percentile, None if
+           empty. counts replaces the counts of the histogram, e.g. by
+           the ones of a time interval.'''
+        if counts is None:
+            counts = self.counts
+        count = counts.sum()
+        if not count:
+            return None
+        index = int(np.searchsorted(np.cumsum(counts),
+                                    percent / 100. * count))
+        return float(self.edges[min(index, len(self.edges) - 1)])
+
+    def mean(self):
+        count = self.count()
+        return self.total / count if count else None
+
+
+class PipelineMetrics(object):
+    '''Thread safe frame counters and latency histograms.
+
+       count and latency are called from the fetching, decoding and gui
+       threads; snapshot returns the totals, the rates since the previous
+       snapshot and the latency percentiles of the frames since then as
+       a flat dict, which formatLine turns into a json or csv line.'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = dict.fromkeys(COUNTERS, 0)
+            self.histograms = dict(
+                (name, LatencyHistogram()) for name in LATENCIES)
+            self._last = (time.time(), dict(self.counters),
+                          self._histogramCounts())
+
+    def count(self, counter, number=1):
+        with self._lock:
+            self.counters[counter] += number
+
+    def setCount(self, counter, number):
+        '''Take over a total counted elsewhere, e.g. dropped frames.'''
+        with self._lock:
+            self.counters[counter] = number
+
+    def latency(self, name, seconds):
+        with self._lock:
+            self.histograms[name].add(max(0., seconds))
+
+    def snapshot(self):
+        now = time.time()
+        with self._lock:
+            counters = dict(self.counters)
+            then, before, binned = self._last
+            current = self._histogramCounts()
+            self._last = (now, counters, current)
+            latencies = [
+                (name, [self.histograms[name].percentile(
+                    pct, current[name] - binned[name])
+                    for pct in PERCENTILES])
+                for name in LATENCIES]
+        elapsed = max(now - then, 1e-9)
+        snap = {"time": round(now, 3)}
+        for name in COUNTERS:
+            snap[name] = counters[name]
+            snap[name + "_rate"] = round(
+                (counters[name] - before[name]) / elapsed, 2)
+        for name, values in latencies:
+            for pct, value in zip(PERCENTILES, values):
+                snap["%s_p%d_ms" % (name, pct)] = \
+                    None if value is None else round(1000. * value, 3)
+        return snap
+
+
+    def _histogramCounts(self):
+        return dict((name, hist.counts.copy())
+                    for name, hist in self.histograms.items())
+
+
+def fields():
+    '''Keys of a snapshot in a fixed order, the csv columns.'''
+    keys = ["time"]
+    for name in COUNTERS:
+        keys.extend([name, name + "_rate"])
+    for name in LATENCIES:
+        keys.extend("%s_p%d_ms" % (name, pct) for pct in PERCENTILES)
+    return keys
+
+
+def formatLine(snap, fmt="json"):
+    '''A snapshot as one line of json or csv (see fields).'''
+    if fmt == "json":
+        return json.dumps(snap, sort_keys=True)
+    return ",".join("" if snap.get(key) is None else str(snap[key])
+                    for key in fields())
+
+
+class MetricsReporter(object):
+    '''Writes a snapshot line of the metrics to a file (name or open file)
+       whenever report is called, csv files start with a header line.'''
+
+    def __init__(self, metrics, output, fmt="json"):
+        if fmt not in ("json", "csv"):
+            raise ValueError("Unknown metrics format: %s" % fmt)
+        self.metrics = metrics
+        self.fmt = fmt
+        self._own = not hasattr(output, "write")
+        self._file = open(output, "a") if self._own else output
+        if fmt == "csv":
+            self._write(",".join(fields()))
+
+    def report(self, snap=None):
+        '''Write a line, of the given snapshot or a new one; returns it.'''
+        if snap is None:
+            snap = self.metrics.snapshot()
+        self._write(formatLine(snap, self.fmt))
+        return snap
+
+    def _write(self, line):
+        self._file.write(line + "\n")
+        self._file.flush()
+
+    def close(self):
+        if self._own:
+            self._file.close()
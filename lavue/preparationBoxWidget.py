@@ -25,6 +25,7 @@ from PyQt4 import QtCore, QtGui
 from . import transformationsWidget
 #~ from . import maskWidget
 from . import bkgSubtractionWidget
+from . import darkFlatWidget
 
     
 class QHLine(QtGui.QFrame):
@@ -42,6 +43,7 @@ class PreparationBoxWidget(QtGui.QGroupBox):
 
         #~ self.maskW = maskWidget.MaskWidget(parent=self)
         self.bkgSubW = bkgSubtractionWidget.BkgSubtractionkWidget(parent=self)
+        self.darkFlatW = darkFlatWidget.DarkFlatWidget(parent=self)
 
         hline = QHLine()
 
@@ -49,6 +51,7 @@ class PreparationBoxWidget(QtGui.QGroupBox):
 
         vlayout = QtGui.QVBoxLayout()
         #~ vlayout.addWidget(self.maskW)
+        vlayout.addWidget(self.darkFlatW)
         vlayout.addWidget(self.bkgSubW)
         vlayout.addWidget(hline)
         vlayout.addWidget(self.trafoW)
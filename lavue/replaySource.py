@@ -0,0 +1,143 @@
+# Copyright (C) 2017  Christoph Rosemann, DESY, Notkestr. 85, D-22607 Hamburg
+# email contact: christoph.rosemann@desy.de
+#
+# lavue is an image viewing program for photon science imaging detectors.
+# Its usual application is as a live viewer using hidra as data source.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation in  version 2
+# of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+
+# replay of stored or synthetic frames at a fixed rate, for load tests
+
+import os
+import time
+
+import numpy as np
+
+from . import cbfCodec
+from . import dataSource
+
+SYNTHETICFRAMES = 8  # distinct synthetic frames, they are repeated
+
+
+class ReplaySource(dataSource.DataSource):
+    '''Delivers the frame files of a directory, or synthetic byte offset
+       compressed cbf frames of the given (slow, fast) shape, at a fixed
+       rate in Hz.
+
+       Frame k is due at k / rate seconds after the connect; with burst
+       frames per burst they come in groups of burst frames at once, with
+       the same mean rate. jitter shifts every due time randomly by up to
+       jitter periods, the random numbers are seeded, so runs repeat.
+       A receiver falling behind gets the late frames at once, lag is
+       how late the last one was. Without loop the source stops after
+       the last frame.
+       All payloads are loaded or encoded at the connect, receive does
+       no I/O.'''
+
+    def __init__(self, path=None, shape=None, rate=10., loop=True, jitter=0.,
+                 burst=1, seed=0, timeout=None, keepFrames=0):
+        super(ReplaySource, self).__init__(timeout, keepFrames)
+        if path is None and shape is None:
+            raise ValueError("Replay needs a directory or a frame shape")
+        if rate <= 0:
+            raise ValueError("Replay rate has to be positive: %s" % rate)
+        self.path = path
+        self.shape = tuple(shape) if shape is not None else None
+        self.rate = float(rate)
+        self.loop = loop
+        self.jitter = jitter
+        self.burst = max(1, int(burst))
+        self.seed = seed
+        self.frames = []
+        self.delivered = 0
+        self.lag = 0.
+        self._start = None
+        self._nextDue = None
+        self._random = None
+
+    def getTarget(self):
+        if self.path is not None:
+            return "replay of %s" % self.path
+        return "synthetic %dx%d" % self.shape
+
+    def connect(self):
+        try:
+            if not self.frames:
+                self.frames = self._load()
+        except (IOError, OSError) as error:
+            print("[replay source] cannot load the frames: %s" % error)
+            return False
+        if not self.frames:
+            return False
+        self.delivered = 0
+        self.lag = 0.
+        self._random = np.random.RandomState(self.seed)
+        self._start = time.time()
+        self._nextDue = None
+        self._connected = True
+        return True
+
+    def status(self):
+        if not self._connected:
+            return "disconnected"
+        if self.finished():
+            return "finished after %d frames" % self.delivered
+        return "%d frames at %g Hz, lag %.1f ms" % (
+            self.delivered, self.rate, 1000. * self.lag)
+
+    def finished(self):
+        return not self.loop and self.delivered >= len(self.frames)
+
+    def due(self, frame):
+        '''Time of the given frame after the connect in seconds.'''
+        due = (frame // self.burst) * self.burst / self.rate
+        if self.jitter:
+            due += self._random.uniform(-self.jitter, self.jitter) / self.rate
+        return max(due, 0.)
+
+    def receive(self):
+        '''Wait until the next frame is due, up to the timeout.'''
+        if not self._connected or self.finished():
+            if self._timeout is not None:
+                time.sleep(self._timeout / 1000.)
+            return None, None
+        if self._nextDue is None:
+            self._nextDue = self._start + self.due(self.delivered)
+        wait = self._nextDue - time.time()
+        if self._timeout is not None and wait > self._timeout / 1000.:
+            time.sleep(self._timeout / 1000.)
+            return None, None
+        if wait > 0:
+            time.sleep(wait)
+        self.lag = max(0., time.time() - self._nextDue)
+        self._nextDue = None
+        name, data = self.frames[self.delivered % len(self.frames)]
+        metadata = {"filename": name, "frame": self.delivered}
+        self.delivered += 1
+        return data, metadata
+
+    def _load(self):
+        if self.path is None:
+            return [("synthetic_%03d.cbf" % index, cbfCodec.encodeCbf(
+                cbfCodec.syntheticFrame(self.shape, self.seed + index)))
+                for index in range(SYNTHETICFRAMES)]
+        suffixes = tuple(self.decoders.suffixes())
+        frames = []
+        for name in sorted(os.listdir(self.path)):
+            if name.lower().endswith(suffixes):
+                with open(os.path.join(self.path, name), "rb") as payload:
+                    frames.append((name, payload.read()))
+        return frames
@@ -0,0 +1,160 @@
+# Copyright (C) 2017  Christoph Rosemann, DESY, Notkestr. 85, D-22607 Hamburg
+# email contact: christoph.rosemann@desy.de
+#
+# lavue is an image viewing program for photon science imaging detectors.
+# Its usual application is as a live viewer using hidra as data source.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation in  version 2
+# of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+
+# intensity scaling of the display image by lookup tables or ufuncs
+
+import time
+import numpy as np
+
+from . import bufferPool
+
+# the widest integer range (max - min + 1) scaled with a lookup table
+LUTMAXSIZE = 1 << 20
+
+# lower clipping of the log scaling
+LOGMINIMUM = 10e-3
+
+SCALINGMETHODS = ("auto", "table", "float")
+
+
+def scaleFloat(image, scaling, out):
+    '''sqrt or log scaling of image into the float32 array out.'''
+    if scaling == "sqrt":
+        np.clip(image, 0, np.inf, out=out)
+        return np.sqrt(out, out=out)
+    np.clip(image, LOGMINIMUM, np.inf, out=out)
+    return np.log10(out, out=out)
+
+
+def _tableSize(size, maxSize):
+    # a power of two, so that a slowly growing range rarely rebuilds
+    table = 1024
+    while table < size:
+        table *= 2
+    return max(size, min(table, maxSize))
+
+
+class ScalingEngine(object):
+    '''sqrt or log scaling, for integer images by lookup tables.
+
+       Detector counts are bounded integers: a table of the scaled values
+       over the observed range is built once and applied with np.take.
+       Images of another dtype or a range wider than maxSize use the
+       float path. method "auto" times both on the first integer image
+       of every scaling and keeps the faster one.
+       The tables can also be fused with a colour table, mapping the
+       counts directly to RGBA for display only.'''
+
+    def __init__(self, method="auto", maxSize=LUTMAXSIZE, pool=None):
+        if method not in SCALINGMETHODS:
+            raise ValueError("Unknown scaling method %s, choose from %s"
+                             % (method, ", ".join(SCALINGMETHODS)))
+        self.method = method
+        self.maxSize = maxSize
+        self.pool = pool or bufferPool.BufferPool()
+        # scaling: (first count, table)
+        self._tables = {}
+        # scaling: method chosen by "auto"
+        self._methods = {}
+        # key, colour table and the fused RGBA table of the last colourise
+        self._colourTable = None
+
+    def table(self, scaling, low, high):
+        '''The first count and a float32 table of the scaled counts
+           covering low to high, or None if the range is too wide.'''
+        cached = self._tables.get(scaling)
+        if cached is not None and cached[0] <= low and \
+                high < cached[0] + cached[1].size:
+            return cached
+        if high - low >= self.maxSize:
+            return None
+        start, stop = min(low, 0), high + 1
+        if cached is not None:
+            start = min(start, cached[0])
+            stop = max(stop, cached[0] + cached[1].size)
+        if stop - start > self.maxSize:
+            start, stop = low, high + 1
+        counts = np.arange(
+            start, start + _tableSize(stop - start, self.maxSize),
+            dtype=np.float64)
+        table = np.empty(counts.size, dtype=np.float32)
+        scaleFloat(counts, scaling, table)
+        self._tables[scaling] = (start, table)
+        self._colourTable = None
+        return start, table
+
+    def _indices(self, image, first):
+        if first == 0:
+            return image
+        indices = self.pool.getScratch(
+            "scaling-indices", image.size, np.int32).reshape(image.shape)
+        return np.subtract(image, np.int64(first), out=indices,
+                           casting="unsafe")
+
+    def scale(self, image, scaling, out):
+        '''sqrt or log scaling of image into the float32 array out.'''
+        method = self.method
+        if method == "auto":
+            method = self._methods.get(scaling, "auto")
+        if method == "float" or image.dtype.kind not in "iu" or \
+                not image.size:
+            return scaleFloat(image, scaling, out)
+        cached = self.table(scaling, int(image.min()), int(image.max()))
+        if cached is None:
+            return scaleFloat(image, scaling, out)
+        # the range has been checked, clip only skips the bounds check
+        np.take(cached[1], self._indices(image, cached[0]), out=out,
+                mode="clip")
+        if method == "auto":
+            start = time.time()
+            np.take(cached[1], self._indices(image, cached[0]), out=out,
+                    mode="clip")
+            tableTime = time.time() - start
+            start = time.time()
+            scaleFloat(image, scaling, out)
+            self._methods[scaling] = "table" \
+                if tableTime < time.time() - start else "float"
+        return out
+
+    def colourise(self, image, scaling, levels, colours):
+        '''RGBA uint8 image of the scaled counts mapped through the
+           colour table colours (n x 4 uint8) between the levels (in
+           scaled units). None if the image can not use a table.'''
+        if image.dtype.kind not in "iu" or not image.size:
+            return None
+        cached = self.table(scaling, int(image.min()), int(image.max()))
+        if cached is None:
+            return None
+        first, table = cached
+        key = (scaling, tuple(levels), first)
+        cached = self._colourTable
+        if cached is not None and cached[0] == key and \
+                cached[1] is colours:
+            rgba = cached[2]
+        else:
+            low, high = float(levels[0]), float(levels[1])
+            scale = (len(colours) - 1) / max(high - low, 1e-12)
+            index = np.clip((table - low) * scale, 0, len(colours) - 1)
+            rgba = np.asarray(colours, dtype=np.uint8)[
+                index.astype(np.intp)]
+            self._colourTable = (key, colours, rgba)
+        return np.take(rgba, self._indices(image, first), axis=0,
+                       mode="clip")
@@ -0,0 +1,265 @@
+# Copyright (C) 2017  Christoph Rosemann, DESY, Notkestr. 85, D-22607 Hamburg
+# email contact: christoph.rosemann@desy.de
+#
+# lavue is an image viewing program for photon science imaging detectors.
+# Its usual application is as a live viewer using hidra as data source.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation in  version 2
+# of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+
+# frames received and decoded in a separate process, handed over in
+# shared memory
+
+from __future__ import print_function
+
+import functools
+import multiprocessing
+import threading
+
+import numpy as np
+
+from . import cbfCodec
+from . import dataSource
+from . import decodePool
+
+try:
+    # python >= 3.8
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+SLOTS = 6  # frames in the shared ring
+SLOTBYTES = 32 * 1024 * 1024  # largest frame, a 6M int32 frame needs 25 MB
+DECODEWORKERS = 2  # decoding threads of the acquisition process
+
+
+class SharedMemorySource(dataSource.DataSource):
+    '''Runs another data source in an acquisition process, so that
+       neither receiving nor decoding share the GIL of the gui.
+
+       The acquisition process decodes the frames into the slots of a
+       shared memory ring and only sends (sequence number, slot, name,
+       shape, dtype, receiving time, orientation) here; decode maps the
+       slot without a copy. A slot is owned by this process until the
+       image is given back with releaseData, frames arriving while no
+       slot is free are dropped by the acquisition process. The other
+       methods are forwarded to the source in the acquisition process,
+       where a thread of their own serves them while the main thread
+       receives; methods without a result are posted without waiting.'''
+
+    def __init__(self, source="hidra", sourceOptions=None, timeout=None,
+                 keepFrames=0, slots=SLOTS, slotBytes=SLOTBYTES,
+                 workers=DECODEWORKERS):
+        super(SharedMemorySource, self).__init__(timeout)
+        if shared_memory is None:
+            raise RuntimeError("The shared memory transport needs python 3.8")
+        self.kind = source
+        self.slots = slots
+        self.slotBytes = slotBytes
+        self._memory = shared_memory.SharedMemory(
+            create=True, size=slots * slotBytes)
+        self._notices = multiprocessing.Queue()
+        self._free = multiprocessing.Queue()
+        for slot in range(slots):
+            self._free.put(slot)
+        self._control, child = multiprocessing.Pipe()
+        self._lock = threading.Lock()
+        # address of the first byte of every slot, to find the slot of
+        # an image in releaseData
+        base = np.frombuffer(self._memory.buf, dtype=np.uint8)
+        self._address = base.__array_interface__["data"][0]
+        options = dict(sourceOptions or {})
+        options.update(timeout=timeout, keepFrames=keepFrames)
+        self._process = multiprocessing.Process(
+            target=_acquire, args=(
+                source, options, self._memory.name, slots, slotBytes,
+                workers, cbfCodec.currentBackend(), self._notices,
+                self._free, child))
+        self._process.daemon = True
+        self._process.start()
+        if self.call("hasattr", "setSignalHost"):
+            # a hidra source, the server is chosen here
+            self.setSignalHost = functools.partial(
+                self.post, "setSignalHost")
+
+    def call(self, method, *args):
+        '''Call a method of the source in the acquisition process.'''
+        with self._lock:
+            self._control.send((method, args, True))
+            ok, result = self._control.recv()
+        if not ok:
+            raise result
+        return result
+
+    def post(self, method, *args):
+        '''Call a method of the source in the acquisition process
+           without waiting for it, errors are only printed there.'''
+        with self._lock:
+            self._control.send((method, args, False))
+
+    def getTarget(self):
+        return self.call("getTarget")
+
+    def connect(self):
+        self._connected = self.call("connect")
+        return self._connected
+
+    def disconnect(self):
+        self._connected = False
+        self.post("disconnect")
+
+    def close(self):
+        if self._process.is_alive():
+            self.call("stop")
+            self._process.join()
+        self._memory.close()
+        self._memory.unlink()
+
+    def status(self):
+        return "%s in acquisition process" % self.call("status")
+
+    def stream(self):
+        return self.kind
+
+    def receive(self):
+        '''Wait for the notice of the next frame in the shared ring.'''
+        try:
+            notice = self._notices.get(
+                timeout=None if self._timeout is None
+                else self._timeout / 1000.)
+        except queue.Empty:
+            return None, None
+        seq, slot, name, shape, dtype, received, orientation = notice
+        return notice, {"filename": name, "slot": slot, "frame": seq,
+                        "received": received}
+
+    def decode(self, data, metadata):
+        '''The frame in its slot of the shared ring, no copy.'''
+        return self.decodeOriented(data, metadata)[0]
+
+    def decodeOriented(self, data, metadata):
+        seq, slot, name, shape, dtype, received, orientation = data
+        return np.ndarray(shape, dtype=dtype, buffer=self._memory.buf,
+                          offset=slot * self.slotBytes), orientation
+
+    def discard(self, data, metadata):
+        # the notice of a frame never decoded still owns its slot
+        self._free.put(data[1])
+
+    def releaseData(self, img):
+        if not isinstance(img, np.ndarray):
+            return
+        offset = img.__array_interface__["data"][0] - self._address
+        if 0 <= offset < self.slots * self.slotBytes:
+            self._free.put(offset // self.slotBytes)
+
+    def setOutput(self, orientation=None, dtype=None):
+        self.post("setOutput", orientation, dtype)
+
+    def region(self, name, top=0, bottom=None, left=0, right=None):
+        return self.call("region", name, top, bottom, left, right)
+
+
+def _acquire(kind, options, memoryName, slots, slotBytes, workers, backend,
+             notices, free, control):
+    '''Main function of the acquisition process.'''
+    memory = shared_memory.SharedMemory(name=memoryName)
+    cbfCodec.selectBackend(backend)
+    source = dataSource.createSource(kind, **options)
+    dropped = [0]
+
+    def deliver(seq, name, frame, received):
+        image, orientation = frame
+        try:
+            slot = free.get_nowait()
+        except queue.Empty:
+            slot = None
+        if slot is None or image.nbytes > slotBytes:
+            dropped[0] += 1
+            if slot is not None:
+                free.put(slot)
+        else:
+            target = np.ndarray(image.shape, dtype=image.dtype,
+                                buffer=memory.buf, offset=slot * slotBytes)
+            target[...] = image
+            notices.put((seq, slot, name, image.shape, image.dtype.str,
+                         received, orientation))
+        source.releaseData(image)
+
+    # the orientation of every frame travels with its notice
+    pool = decodePool.DecodePool(
+        source.decodeOriented, deliver, workers,
+        release=lambda frame: source.releaseData(frame[0]),
+        discard=source.discard)
+    pool.start()
+    # set while connected, the receiving loop is parked otherwise
+    connected = threading.Event()
+    stopped = threading.Event()
+
+    def serve():
+        # commands are served while receive blocks, as the gui thread
+        # of a viewer calls the source while its fetching thread receives
+        while not stopped.is_set():
+            try:
+                method, args, reply = control.recv()
+            except EOFError:
+                # the viewer is gone
+                method, args, reply = "stop", (), False
+            if method == "stop":
+                stopped.set()
+                connected.set()
+                if reply:
+                    control.send((True, None))
+                return
+            try:
+                if method == "hasattr":
+                    result = hasattr(source, *args)
+                elif method == "status" and connected.is_set():
+                    result = "%s, %d frames dropped" % (
+                        source.status(), dropped[0] + pool.dropped)
+                else:
+                    result = getattr(source, method)(*args)
+                if method == "connect" and result:
+                    connected.set()
+                elif method in ("connect", "disconnect"):
+                    connected.clear()
+                if reply:
+                    control.send((True, result))
+            except Exception as error:
+                if reply:
+                    control.send((False, error))
+                else:
+                    print("[acquisition] %s failed: %s" % (method, error))
+
+    server = threading.Thread(target=serve)
+    server.daemon = True
+    server.start()
+    try:
+        while not stopped.is_set():
+            connected.wait()
+            if stopped.is_set():
+                break
+            data, metadata = source.receive()
+            if data is not None:
+                pool.submit(metadata["filename"], data, metadata)
+    finally:
+        pool.stop()
+        source.close()
+        memory.close()
@@ -63,7 +63,7 @@ class StatisticsWidget(QtGui.QGroupBox):
         if self.scaling is not scaling:
             self.scaling = scaling
         self.scaleLabel.setText(self.scaling)
-        self.meanVal.setText(meanVal)
-        self.maxVal.setText(maxVal)
-        self.varVal.setText(varVal)
+        self.meanVal.setText("%.4f" % meanVal)
+        self.maxVal.setText("%.4f" % maxVal)
+        self.varVal.setText("%.4f" % varVal)
 